@@ -0,0 +1,90 @@
+from maya import cmds
+from node_editor_plus import nep_codec
+
+BOOKMARK_INFO_TYPE = "nodeGraphEditorBookmarkInfo"
+ATTR_NAME = "NEP_DATA"
+
+
+class NEPBookmarkIndex():
+    ''' Maps bookmark names to their nodeGraphEditorBookmarkInfo nodes and caches the parsed NEP
+    payload of each info node, so finding or reading a bookmark doesn't query every info node.
+    The bookmark decorators in overrides keep it up to date when bookmarks are created, renamed,
+    replaced or deleted, only the bookmarks involved are touched.
+    '''
+    _names = None     # {bookmark name: info node}, None until first needed
+    _payloads = None  # {info node: {"bookmark": [records]}}
+
+    def __init__(self):
+        self._payloads = {}
+
+    def invalidate(self, info_nodes=None):
+        # forgets the payloads of the given info nodes, or everything when called without arguments
+        if info_nodes is None:
+            self._names = None
+            self._payloads = {}
+        else:
+            for info_node in info_nodes:
+                self._payloads.pop(info_node, None)
+
+    def add(self, info_node):
+        # a bookmark was created
+        self.invalidate([info_node])
+        if self._names is not None:
+            name = cmds.getAttr(info_node + '.name')
+            if name:
+                self._names[name] = info_node
+
+    def rename(self, info_node, name):
+        if self._names is not None:
+            self._forget_name(info_node)
+            if name:
+                self._names[name] = info_node
+
+    def remove(self, info_nodes):
+        # bookmarks are about to be deleted
+        self.invalidate(info_nodes)
+        if self._names is not None:
+            for info_node in info_nodes:
+                self._forget_name(info_node)
+
+    def _forget_name(self, info_node):
+        for name in [name for name, node in self._names.items() if node == info_node]:
+            del self._names[name]
+
+    def get_names(self):
+        if self._names is None:
+            self._names = {}
+            for info_node in cmds.ls(type=BOOKMARK_INFO_TYPE) or []:
+                name = cmds.getAttr(info_node + '.name')
+                if not name:
+                    # ignore bookmarks with null descriptions, these are likely
+                    # implicitly saved panel states
+                    continue
+                self._names[name] = info_node
+        return self._names
+
+    def get_info_nodes(self):
+        return cmds.ls(type=BOOKMARK_INFO_TYPE) or []
+
+    def find(self, bookmark_name):
+        # info node of the bookmark with the given name, None if there isn't one
+        info_node = self.get_names().get(bookmark_name)
+        if info_node and not cmds.objExists(info_node):
+            self.invalidate()  # changed behind our back, rebuild once
+            info_node = self.get_names().get(bookmark_name)
+        return info_node
+
+    def get_payload(self, info_node):
+        # parsed NEP data of info_node, an empty dict if it has none
+        if info_node not in self._payloads:
+            payload = {}
+            if cmds.objExists(info_node) and cmds.attributeQuery(ATTR_NAME, node=info_node, exists=True):
+                payload = nep_codec.decode_document(cmds.getAttr(info_node + "." + ATTR_NAME))
+            self._payloads[info_node] = payload
+        return self._payloads[info_node]
+
+    def set_payload(self, info_node, payload):
+        if not cmds.attributeQuery(ATTR_NAME, node=info_node, exists=True):
+            cmds.addAttr(info_node, ln=ATTR_NAME, dataType="string")
+        cmds.setAttr(info_node + "." + ATTR_NAME, nep_codec.encode_document(payload), type="string")
+        self._payloads[info_node] = payload
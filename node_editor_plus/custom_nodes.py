@@ -1,14 +1,23 @@
-import base64
+import time, base64
 from functools import partial
+import shiboken2
 from PySide2.QtWidgets import *
 from PySide2.QtGui import *
 from PySide2.QtCore import *
+from node_editor_plus import pixmap_cache
+from node_editor_plus import profiler
 
 # color constants
 COLOR_DEFAULT  = QColor(255,255,255,50)
 COLOR_SELECTED = QColor(67, 252, 162, 255)
+COLOR_PLACEHOLDER = QColor(255,255,255,20)
 GRID_SIZE = 30 # eyeballed for snapping
 
+# level of detail thresholds, see NEPComment.update_lod
+LOD_DETAIL = 0.4  # below this labels and pins are hidden and corners are square
+LOD_BLOCK  = 0.15 # below this images are drawn as a flat block of their average color
+CONTAIN_RATIO = 0.5 # fraction of a node's area that has to be inside a comment to be dragged with it
+
 class NEPRenameLabelFilter(QObject):
     # checks inputs during rename of a comment label
     def __init__(self, item):
@@ -19,8 +28,7 @@ class NEPRenameLabelFilter(QObject):
         if event.type() == QEvent.Type.KeyPress:
             if   event.key() == Qt.Key_Escape:
                 self.item.cancel_update_label()
-            elif event.key() == Qt.Key_Return or event.key() == Qt.Key_Enter:
-                self.item.label_text_edit.setVisible(False)
+                return True
 
         return False
 
@@ -44,19 +52,39 @@ class NEPComment(QGraphicsItem):
     bg_color = None
     Qlabel = None
     content_rect    = None
-    label_text_edit = None
+    label_text_edit = None  # shared rename editor, only set on the comment being renamed
     manhattanLength = 0
     is_showing_resize_cursor = False
     is_pinned = False
     pin_icon_off = None
     pin_icon_on  = None
-    temp_item_list = []
+    painted_header = True  # paint label and pin instead of embedding QLabel/QToolButton proxies
+    label_text_rect = None
+    pin_rect = None
+    _font = None          # shared by all comments, see get_font_metrics
+    _font_metrics = None
+    _pin_pixmaps = None
+    _rename_proxy = None  # the single rename editor, exists only while a rename is in progress
+    _renaming_item = None
+    members = None     # items carried by the comment, see update_members
+    _drag_items = None # members moved by the drag in progress, see begin_drag
+    _drag_pos  = None
+    _drag_rect = None
+    _record = None  # cached to_record(), cleared by mark_dirty
+    label_proxy = None
+    pin_proxy   = None
+    is_detailed = True  # False while zoomed out below LOD_DETAIL
+    border_color = Qt.black
+    _paint_path = None  # paint resources, see update_paint_cache
+    _pen   = None
+    _brush = None
+    _label_pen = None
     def __init__(self, label, content_rect, NEP, bg_color=None, is_pinned=False):
         super().__init__()
         self.node_type = type(self)
         self._NEP = NEP
-        self.pin_icon_off = QIcon(":/pinItem.png")
-        self.pin_icon_on  = QIcon(":/pinON.png")
+        self.members = set()
+        self.pin_icon_off, self.pin_icon_on = self.get_pin_icons()
 
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsSelectable, True)
@@ -79,39 +107,77 @@ class NEPComment(QGraphicsItem):
                 self.bg_color.setAlpha(50)
                 self.update_label_color(self.bg_color)
 
+    @classmethod
+    def get_pin_icons(cls):
+        # (off, on) icons created once for every comment
+        if NEPComment.pin_icon_off is None:
+            NEPComment.pin_icon_off = QIcon(":/pinItem.png")
+            NEPComment.pin_icon_on  = QIcon(":/pinON.png")
+        return NEPComment.pin_icon_off, NEPComment.pin_icon_on
+
+    @classmethod
+    def get_pin_pixmap(cls, is_pinned):
+        if NEPComment._pin_pixmaps is None:
+            NEPComment._pin_pixmaps = {False: cls.get_pin_icons()[0].pixmap(QSize(20, 20)),
+                                       True:  cls.get_pin_icons()[1].pixmap(QSize(20, 20))}
+        return NEPComment._pin_pixmaps[is_pinned]
+
+    @classmethod
+    def get_font_metrics(cls):
+        if NEPComment._font_metrics is None:
+            NEPComment._font = QFont()
+            NEPComment._font_metrics = QFontMetricsF(NEPComment._font)
+        return NEPComment._font_metrics
+
     def update_manhattan_length(self):
         self.manhattanLength = self.content_rect.bottomRight().manhattanLength()
 
-    def add_child(self, item):
-        # On start drag, parents and fixes position of overlapping nodes
-        old_pos = item.scenePos()
-        item.setParentItem(self)
-        item.setPos(self.sceneTransform().inverted()[0].map(old_pos))
-
-    def remove_child(self, item):
-        # On stop drag, unparents and fixes position of child nodes
+    def to_record(self):
+        # what gets saved for this item, see nep_codec
+        return {"nep_type": "comment", "label": self.label, "pos": {"x": self.pos().x(), "y": self.pos().y()},
+                "width": self.content_rect.width(), "height": self.content_rect.height(),
+                "bg_color": self.bg_color.name(), "is_pinned": self.is_pinned}
+
+    def get_record(self):
+        # to_record() of the last unchanged state, keeps snapshots of big tabs cheap
+        if self._record is None:
+            self._record = self.to_record()
+        return self._record
+
+    def mark_dirty(self):
+        # lets NEP know this tab needs to be saved again
+        self._record = None
         scene = self.scene()
-        old_pos = item.scenePos()
-        self.temp_item_list.append(item) # hack to avoid item to be deleted, seems to work
-        item.setParentItem( None )
-        #scene.addItem(item)
-        item.setPos( old_pos )
+        if scene and self._NEP:
+            self._NEP.mark_dirty(scene)
 
     def delete(self):
         scene = self.scene()
+        self.close_rename_edit_line()
+        self.mark_dirty()
+        rect = self.get_scene_content_rect()
         scene.removeItem(self)
+        update_memberships(scene, [rect])
 
     def toggle_pin(self):
         if self.is_pinned:
             self.is_pinned = False
-            self.pin_button.setIcon(self.pin_icon_off)
             self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, True)
         else:
             self.is_pinned = True
-            self.pin_button.setIcon(self.pin_icon_on)
             self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemIsMovable, False)
+        if self.painted_header:
+            self.update(self.pin_rect)
+        else:
+            self.pin_button.setIcon(self.pin_icon_on if self.is_pinned else self.pin_icon_off)
+        self.mark_dirty()
 
     def create_pin_icon(self, is_pinned):
+        self.pin_rect = QRectF(self.label_rect.x()-24, self.label_rect.y(), 24, 24)
+        if self.painted_header:
+            self.is_pinned = is_pinned
+            return
+
         self.pin_button = QToolButton()
         self.pin_button.setFixedSize(24,24)
         if not is_pinned:
@@ -123,168 +189,327 @@ class NEPComment(QGraphicsItem):
         self.pin_button.released.connect(self.toggle_pin)
         self.is_pinned = is_pinned
 
-        pxy = QGraphicsProxyWidget(self)
-        pxy.setWidget( self.pin_button )
-        pxy.setPos( self.label_rect.x()-24, self.label_rect.y() )
+        self.pin_proxy = QGraphicsProxyWidget(self)
+        self.pin_proxy.setWidget( self.pin_button )
+        self.pin_proxy.setPos( self.label_rect.x()-24, self.label_rect.y() )
 
 
 
     def set_label(self, label):
+        font_metrics = self.get_font_metrics()
+        if self.painted_header:
+            self.prepareGeometryChange()  # label is part of the bounding rect
         self.label = label
-        self.label_rect = QFontMetricsF(QFont()).boundingRect(label)
+        self.label_rect = font_metrics.boundingRect(label)
         self.label_rect.adjust(15, -20, 0, 0)
+        self.label_text_rect = QRectF(self.label_rect.x(), self.label_rect.y(),
+                                      font_metrics.horizontalAdvance(label) + 4, font_metrics.height())
 
-        if not self.Qlabel:
+        self.mark_dirty()
+
+        if self.painted_header:
+            self.update()
+        elif not self.Qlabel:
             self.Qlabel = QLabel(self.label)
             self._labelFilter = NEPLabelFilter(self)
             self.Qlabel.installEventFilter(self._labelFilter)
             self.Qlabel.setAttribute(Qt.WA_NoSystemBackground)
-            pxy = QGraphicsProxyWidget(self)
-            pxy.setWidget( self.Qlabel )
-            pxy.setPos( self.label_rect.x(), self.label_rect.y() )
+            self.label_proxy = QGraphicsProxyWidget(self)
+            self.label_proxy.setWidget( self.Qlabel )
+            self.label_proxy.setPos( self.label_rect.x(), self.label_rect.y() )
         else:
             self.Qlabel.setText(self.label)
         
     def boundingRect(self):
+        if self.painted_header:
+            return self.content_rect.united(self.label_text_rect).united(self.pin_rect)
         return self.content_rect
 
-    def paint(self, painter, option, widget):
-        if self.isSelected():
-            pen      = QPen(COLOR_SELECTED, 2)
-        else:
-            pen      = QPen(Qt.black, 2)
-
+    def shape(self):
+        # the body plus the label and pin, not the empty corner between them
         path = QPainterPath()
-        path.addRoundedRect(self.content_rect, self.round_corners_size, self.round_corners_size)
+        path.addRect(self.content_rect)
+        if self.painted_header:
+            path.addRect(self.label_text_rect)
+            path.addRect(self.pin_rect)
+        return path
+
+    def get_scene_content_rect(self):
+        return self.mapToScene(self.content_rect).boundingRect()
+
+    def query_body_items(self):
+        # everything whose bounding rect touches the body, answered by the scene's index
+        return self.scene().items(self.get_scene_content_rect(), Qt.IntersectsItemBoundingRect)
+
+    def get_contained_items(self):
+        ''' Native Maya nodes, images and smaller comments with at least CONTAIN_RATIO of their
+        area inside the body of the comment. Only bounding rects are tested, so connections or
+        node shapes are never intersected.
+        '''
+        rect = self.get_scene_content_rect()
+        area = rect.width() * rect.height()
+        contained = []
+        for item in self.query_body_items():
+            item_type = type(item)
+            if item_type == NEPComment or item_type == NEPImage:
+                if item is self:
+                    continue
+                bounds = item.get_scene_content_rect()
+                if bounds.width() * bounds.height() >= area:
+                    continue  # the outer one of two overlapping comments
+            elif item_type != QGraphicsItem or item.flags() & QGraphicsItem.ItemIsFocusable:
+                continue  # connections and the searchbox
+            else:
+                bounds = item.sceneBoundingRect()
+            inside = bounds.intersected(rect)
+            if inside.width() * inside.height() >= bounds.width() * bounds.height() * CONTAIN_RATIO:
+                contained.append(item)
+        return contained
+
+    def update_members(self):
+        # images don't carry anything, see update_memberships for when this runs
+        if self.node_type == NEPComment:
+            self.members = set(self.get_contained_items())
+
+    def get_drag_members(self, claimed):
+        ''' Members moving along with this comment, members of nested comments included.
+        Selected items are moved by Qt itself (selected comments carry their own members) and
+        pinned ones stay where they are. Items in claimed are already carried by another comment
+        of the same drag, the ones returned are added to it so nothing moves twice.
+        Members are kept up to date by update_memberships, the scene isn't queried here. Maya
+        deletes its nodes without telling us, those are dropped as they are found.
+        '''
+        scene = self.scene()
+        carried = []
+        pending = [self]
+        while pending:
+            comment = pending.pop()
+            comment.members = {item for item in comment.members if shiboken2.isValid(item) and item.scene() is scene}
+            for item in comment.members:
+                if item in claimed:
+                    continue
+                claimed.add(item)
+                if item.isSelected() or (type(item) != QGraphicsItem and item.is_pinned):
+                    continue
+                carried.append(item)
+                if type(item) == NEPComment:
+                    pending.append(item)
+        return carried
+
+    def begin_drag(self, claimed):
+        # members are translated by apply_drag from here on, used by the aligner
+        self._drag_items = self.get_drag_members(claimed)
+        self._drag_pos = self.pos()
+        self._drag_rect = self.get_scene_content_rect()
+
+    def apply_drag(self):
+        # moves the members by how much the comment moved since the last call
+        # returns how many items were moved
+        if not self._drag_items:
+            return 0
+        delta = self.pos() - self._drag_pos
+        if delta.isNull():
+            return 0
+        self._drag_pos = self.pos()
+        moved = 0
+        for item in self._drag_items:
+            try:
+                item.moveBy(delta.x(), delta.y())
+                moved += 1
+            except RuntimeError:
+                pass  # deleted by Maya while dragging
+        return moved
+
+    def end_drag(self):
+        # members are refreshed where the comment was picked up and where it was dropped
+        if self._drag_rect is None:
+            return
+        self.apply_drag()
+        rects = [self._drag_rect, self.get_scene_content_rect()]
+        self._drag_items = self._drag_pos = self._drag_rect = None
+        update_memberships(self.scene(), rects)
+
+    def is_header_visible(self):
+        return self.painted_header and self.is_detailed
+
+    def hit_pin(self, event):
+        return self.is_header_visible() and event.button() == Qt.LeftButton and self.pin_rect.contains(event.pos())
+
+    def paint_header(self, painter):
+        # painted replacement of the label and pin proxy widgets
+        painter.drawPixmap(self.pin_rect.adjusted(2, 2, -2, -2).toRect(), self.get_pin_pixmap(self.is_pinned))
+        if self._renaming_item is not self:
+            painter.setPen(self._label_pen)
+            painter.setFont(self._font)
+            painter.drawText(self.label_text_rect, Qt.AlignLeft | Qt.AlignVCenter, self.label)
+
+    def update_lod(self, painter, option):
+        ''' Returns the level of detail the item is painted at. Proxy widgets are hidden when
+        zooming out past LOD_DETAIL so they don't get laid out and rendered as unreadable dots,
+        this only happens when the threshold is crossed, not on every paint.
+        '''
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        is_detailed = lod >= LOD_DETAIL
+        if is_detailed != self.is_detailed:
+            self.is_detailed = is_detailed
+            if not self.painted_header:
+                # changing children visibility while the scene is painting is not safe, do it right after
+                QTimer.singleShot(0, self.update_proxies_visibility)
+        return lod
+
+    def update_proxies_visibility(self):
+        try:
+            self.pin_proxy.setVisible(self.is_detailed)
+            self.label_proxy.setVisible(self.is_detailed and self._renaming_item is not self)
+        except RuntimeError:
+            pass  # item was deleted before we got here
+
+    def update_paint_cache(self):
+        ''' Builds the path, pen and brush paint() uses. They only change with the geometry,
+        the color or the selection, so paint() doesn't allocate them again on every frame.
+        '''
+        self._paint_path = QPainterPath()
+        self._paint_path.addRoundedRect(self.content_rect, self.round_corners_size, self.round_corners_size)
+        self._pen   = QPen(COLOR_SELECTED if self.isSelected() else self.border_color, 2)
+        self._brush = QBrush(self.bg_color)
+        self._label_pen = QPen(COLOR_SELECTED if self.isSelected() else QColor(self.bg_color.rgb()))
+
+    def invalidate_paint_cache(self):
+        self._paint_path = None
+        self.update()
 
-        painter.setPen(pen)
-        painter.fillPath(path, self.bg_color )
-        painter.drawPath(path)
+    @profiler.timed_paint("NEPComment")
+    def paint(self, painter, option, widget):
+        lod = self.update_lod(painter, option)
+        if self._paint_path is None:
+            self.update_paint_cache()
+
+        painter.setPen(self._pen)
+        if lod < LOD_DETAIL:
+            # corners are a couple pixels on screen at this zoom, not worth the path
+            painter.setBrush(self._brush)
+            painter.drawRect(self.content_rect)
+            return
+
+        painter.fillPath(self._paint_path, self._brush)
+        painter.drawPath(self._paint_path)
+        if self.painted_header:
+            self.paint_header(painter)
 
     def show_rename_edit_line(self):
-        if not self.label_text_edit:
-            self.label_text_edit = QLineEdit(self.label)
-            self.label_text_edit.editingFinished.connect(self.update_label)
-            self._NEPRenameLabelFilter = NEPRenameLabelFilter(self)
-            self.label_text_edit.installEventFilter(self._NEPRenameLabelFilter)
-            pxy = QGraphicsProxyWidget(self)
-            pxy.setWidget( self.label_text_edit )
-
-            pxy.setPos( self.label_rect.x(), self.label_rect.y() )
+        ''' Shows the rename editor over the label. There is a single editor for all comments,
+        created here and destroyed by close_rename_edit_line when the rename ends.
+        '''
+        if NEPComment._renaming_item:
+            NEPComment._renaming_item.cancel_update_label()
+
+        self.label_text_edit = QLineEdit(self.label)
+        self.label_text_edit.editingFinished.connect(self.update_label)
+        self._NEPRenameLabelFilter = NEPRenameLabelFilter(self)
+        self.label_text_edit.installEventFilter(self._NEPRenameLabelFilter)
+        NEPComment._rename_proxy = QGraphicsProxyWidget(self)
+        NEPComment._rename_proxy.setWidget( self.label_text_edit )
+        NEPComment._rename_proxy.setPos( self.label_rect.x(), self.label_rect.y() )
+        NEPComment._renaming_item = self
+        if self.Qlabel:
+            self.Qlabel.setVisible(False)
         else:
-            self.label_text_edit.setVisible(True)
-        self.Qlabel.setVisible(False)
+            self.update()
 
         self.label_text_edit.setFixedWidth( max(min(self.label_rect.width(), 500), 150) )
         self.label_text_edit.selectAll()
         self.label_text_edit.setFocus()
-        self._old_label = self.label_text_edit.text()
-        
+
+    def close_rename_edit_line(self):
+        if NEPComment._renaming_item is not self:
+            return
+        # editingFinished would fire again when the editor loses focus
+        self.label_text_edit.blockSignals(True)
+        NEPComment._rename_proxy.hide()
+        NEPComment._rename_proxy.deleteLater()
+        NEPComment._rename_proxy = None
+        NEPComment._renaming_item = None
+        self.label_text_edit = None
+        if self.Qlabel:
+            self.Qlabel.setVisible(self.is_detailed)
+        else:
+            self.update()
+
     def cancel_update_label(self):
-        self.label_text_edit.setText(self._old_label)
-        self.label_text_edit.setVisible(False)
-        self.Qlabel.setVisible(True)
+        self.close_rename_edit_line()
 
     def update_label(self, *args):
+        if NEPComment._renaming_item is not self:
+            return
         new_label = self.label_text_edit.text()
         if new_label:
             self.set_label( new_label )
-            self.label_text_edit.setVisible(False)
-            self.Qlabel.setVisible(True)
-
-    def mousePressEvent(self, event, passive=False):
-        ''' Start dragging - check overlapping nodes and parent to itself.
+        self.close_rename_edit_line()
+
+    def mouseDoubleClickEvent(self, event):
+        # double click on the painted label starts a rename
+        if self.is_header_visible() and self.node_type == NEPComment and self.label_text_rect.contains(event.pos()):
+            self.show_rename_edit_line()
+            event.accept()
+            return
+        super().mouseDoubleClickEvent(event)
+
+    def mousePressEvent(self, event):
+        ''' Start dragging - members of this and every other selected comment move along.
         Ignores if node is pinned.
         '''
-        if not passive:
-            self._NEP._drag_manager.start_drag(caller=self, scene=self.scene(), event=event)
+        if self.hit_pin(event):
+            self.toggle_pin()
+            event.accept()
+            return
 
         if self.is_pinned: return
         super().mousePressEvent(event)
 
         # closes edit if a click is detected (trying to drag)
         if self.label_text_edit:
-            if self.label_text_edit.isVisible():
-                self.cancel_update_label()
+            self.cancel_update_label()
 
-        if self.is_pinned: return
-
-        children = self.childItems() # cache
-        colliding_items = self.collidingItems()
-        if colliding_items:
-            for item in colliding_items:
-                item_type = type(item)
-                if item_type == QGraphicsItem or item_type == NEPImage:
-                    if item not in children:
-                        if item_type == NEPImage:
-                            if not item.is_pinned:
-                                self.add_child(item)
-                        else: # this is a native Maya node
-                            if not bool(item.flags() & QGraphicsItem.ItemIsFocusable): # skip searchbox
-                                self.add_child(item)
-
-
-    def drag_update_hack(self):
-        children = self.childItems()
-        if children:
-            for ch in children:
-                ch.moveBy(0.000001, 0)
+        # once Qt has updated the selection, so it matches what is dragged
+        self._NEP._drag_manager.start_drag(caller=self, scene=self.scene())
 
     def mouseMoveEvent(self, event):
-        ''' Dragging code - hack to update connections when dragging
+        ''' Dragging code - members are moved once per frame by NEPDragManager
         Ignores if node is pinned.
         '''
         # calculate resize first
         if self.is_showing_resize_cursor:
             self.resize_comment( event )
         else:
+            start = time.perf_counter() if profiler.is_enabled() else None
             self._NEP._drag_manager.mid_drag()
 
             # if it's not resizing then it's moving
             if self.is_pinned: return
 
             super().mouseMoveEvent(event)
-            self.drag_update_hack()
+            if start is not None:
+                profiler.record_drag(time.perf_counter() - start)
 
-    def mouseReleaseEvent(self, event, passive=None):
-        ''' Dragging code - hack to update connections when dragging
-        Ignores if node is pinned.
+    def mouseReleaseEvent(self, event):
+        ''' Dragging code - moves the members to where the comments were dropped
         '''
-        if not passive:
-            self._NEP._drag_manager.stop_drag(event=event)
+        self._NEP._drag_manager.stop_drag()
 
         super().mouseReleaseEvent(event)
 
-        # if released while resizing, update manhattanlength
+        # if released while resizing, update manhattanlength and what the comment holds
         if self.is_showing_resize_cursor:
             self.update_manhattan_length()
             self.hide_resize_cursor() # force disable resize cursor
-
-        # don't move update anything if pinned, can't drag anyway
-        if self.is_pinned: return
-        
-        self.drag_update_hack()
-
-        children = self.childItems()
-        if children:
-            # hack to refresh C++ objects everytime children count change
-            # so we're not pointing to objects that got deleted
-            while True:
-                children = self.childItems()
-                can_exit = True
-                for item in children:
-                    item_type = type(item)
-                    if item_type == QGraphicsItem or item_type == NEPImage:
-                        self.remove_child(item)
-                        can_exit = False
-                        break
-                if can_exit:
-                    break
+            update_memberships(self.scene(), [self.get_scene_content_rect()])
 
     def resize_comment(self, event):
         self.prepareGeometryChange()
         self.content_rect.setWidth(event.pos().x()+10) # hardcoded offset
         self.content_rect.setHeight(event.pos().y()+10)
+        self.invalidate_paint_cache()
+        self.mark_dirty()
 
 
     def show_resize_cursor(self):
@@ -296,7 +521,7 @@ class NEPComment(QGraphicsItem):
         self.is_showing_resize_cursor = False
 
     def hoverMoveEvent(self, event):
-        if event.pos().manhattanLength() > self.manhattanLength - 24:
+        if self.content_rect.contains(event.pos()) and event.pos().manhattanLength() > self.manhattanLength - 24:
             if not self.is_showing_resize_cursor:
                 self.show_resize_cursor()
         else:
@@ -315,13 +540,18 @@ class NEPComment(QGraphicsItem):
             new_color.setAlpha(50)
             self.bg_color = new_color
             self.update_label_color(new_color)
+            self.invalidate_paint_cache()
+            self.mark_dirty()
 
     def update_label_color(self, QColor):
+        if not self.Qlabel:
+            return  # painted labels take their color from update_paint_cache
         self.Qlabel.setStyleSheet("QLabel { color : "+QColor.name()+"; }")
 
     def itemChange(self, change, value):
         # tracks select status
         if change == QGraphicsItem.GraphicsItemChange.ItemSelectedChange:
+            self.invalidate_paint_cache()
             if value:
                 self.update_label_color(COLOR_SELECTED)
             else:
@@ -332,84 +562,202 @@ class NEPComment(QGraphicsItem):
                 x = (round(value.x()/GRID_SIZE)*GRID_SIZE)-14
                 y = (round(value.y()/GRID_SIZE)*GRID_SIZE)-14
                 return( QPointF(x,y) )
+        elif change == QGraphicsItem.GraphicsItemChange.ItemPositionHasChanged:
+            self.mark_dirty()
+        elif change == QGraphicsItem.GraphicsItemChange.ItemSceneHasChanged:
+            # added to a tab
+            if value and self._NEP:
+                self._NEP.mark_dirty(value)
 
         return QGraphicsItem.itemChange(self, change, value)
 
 
+def update_memberships(scene, rects=None):
+    ''' Refreshes the members of the comments touching rects (scene coordinates), of every
+    comment in scene without rects. Runs after comments or images are created, dropped, resized
+    or deleted, after nodes are moved and when Maya selects nodes it just created, see
+    NEPMembershipFilter.
+    '''
+    if scene is None:
+        return
+    if rects is None:
+        comments = [item for item in scene.items() if type(item) == NEPComment]
+    else:
+        comments = set()
+        for rect in rects:
+            comments.update(item for item in scene.items(rect, Qt.IntersectsItemBoundingRect)
+                            if type(item) == NEPComment)
+    for comment in comments:
+        comment.update_members()
+
+
+class NEPMembershipFilter(QObject):
+    ''' Scene filter that updates comment members around the nodes, images and comments dragged
+    in it, and around nodes that get selected: Maya selects the nodes it creates in the editor,
+    so they join the comment they were created in without querying anything on drag.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._moved = []       # [(node, scene bounds on press)]
+        self._selected = set() # native nodes selected on the last selection update
+        self._selection_pending = False
+
+    def watch(self, scene):
+        # installs the filter on scene, the selection is only connected once per scene
+        scene.installEventFilter(self)
+        if not scene.property("nepMembershipWatched"):
+            scene.setProperty("nepMembershipWatched", True)
+            scene.selectionChanged.connect(partial(self.selection_changed, scene))
+
+    def selection_changed(self, scene):
+        # rubber band selections change it many times in a row, handled once they are done
+        if self._selection_pending:
+            return
+        self._selection_pending = True
+        QTimer.singleShot(0, partial(self.update_selected, scene))
+
+    def update_selected(self, scene):
+        self._selection_pending = False
+        if not shiboken2.isValid(scene):
+            return
+        selected = {item for item in scene.selectedItems() if type(item) == QGraphicsItem}
+        new_rect = QRectF()
+        for item in selected - self._selected:
+            new_rect = new_rect.united(item.sceneBoundingRect())
+        self._selected = selected
+        if not new_rect.isNull():
+            update_memberships(scene, [new_rect])
+
+    def eventFilter(self, scene, event):
+        # selection and positions are read once Qt has handled the press and release
+        if event.type() == QEvent.Type.GraphicsSceneMousePress:
+            QTimer.singleShot(0, partial(self.record_selection, scene))
+        elif event.type() == QEvent.Type.GraphicsSceneMouseRelease:
+            QTimer.singleShot(0, partial(self.update_moved, scene))
+        return False
+
+    def record_selection(self, scene):
+        self._moved = [(item, item.sceneBoundingRect()) for item in scene.selectedItems()
+                       if type(item) in (QGraphicsItem, NEPComment, NEPImage)]
+
+    def update_moved(self, scene):
+        moved, self._moved = self._moved, []
+        before = QRectF()
+        after = QRectF()
+        for item, old_rect in moved:
+            if not shiboken2.isValid(item):
+                continue
+            new_rect = item.sceneBoundingRect()
+            if new_rect != old_rect:
+                before = before.united(old_rect)
+                after = after.united(new_rect)
+        if not after.isNull():
+            update_memberships(scene, [before, after])
+
+
 class NEPDragManager():
-    # helper to propagate events to all comments nodes being dragged
-    items_being_dragged = []
-    def start_drag(self, caller, scene, event):
-        # propagates mousePress events to all comments that are not the current one
+    ''' Group drag of every selected comment: the members of all of them are gathered once when
+    the drag starts, without duplicates, and moved together by how much the comment under the
+    mouse moved, once per frame. Qt moves the selected items themselves.
+    The refresh is a zero delay timer started by the first mouse move of a frame: it runs once
+    Qt handled every move of that event loop pass and before the view repaints (the scene's
+    updates reach the viewport through posted events, a pass later), so the comment and its
+    members are painted together.
+    '''
+    items_being_dragged = []  # members of the dragged comments, see NEPComment.get_drag_members
+    refresh_interval = 0   # ms, see above, a fixed interval lets members trail the comment
+    geometry_changes = 0   # members moved by refresh_drag during the last drag
+    _caller = None
+    _drag_pos = None
+    _drag_comments = []
+    _drag_rects = []       # where the dragged comments were picked up
+    _refresh_timer = None
+
+    def get_refresh_timer(self):
+        if self._refresh_timer is None:
+            self._refresh_timer = QTimer()
+            self._refresh_timer.setSingleShot(True)
+            self._refresh_timer.setInterval(self.refresh_interval)
+            self._refresh_timer.timeout.connect(self.refresh_drag)
+        return self._refresh_timer
+
+    def start_drag(self, caller, scene):
+        # pinned comments are not movable, Qt leaves them and their members behind
+        self._caller = caller
+        self._drag_pos = caller.pos()
+        self._drag_comments = [caller] + [item for item in scene.selectedItems() if type(item) == NEPComment
+                                          and item is not caller and not item.is_pinned]
+        self._drag_rects = [comment.get_scene_content_rect() for comment in self._drag_comments]
+        self.geometry_changes = 0
+        claimed = set()
         self.items_being_dragged = []
-        selected_items = scene.selectedItems()
-        if selected_items:
-            for item in selected_items:
-                # conditions
-                if type(item) == NEPComment: # type NEPComment
-                    if not item == caller: # not the caller
-                        self.items_being_dragged.append(item)
-
-        if self.items_being_dragged:
-            for item in self.items_being_dragged:
-                item.mousePressEvent(event, passive=True)
+        for comment in self._drag_comments:
+            self.items_being_dragged.extend(comment.get_drag_members(claimed))
 
     def mid_drag(self):
-        # propagate hack to update connections positions
-        if self.items_being_dragged:
-            for item in self.items_being_dragged:
-                item.drag_update_hack()
-
-    def stop_drag(self, event):
-        # propagates mouseRelease to all comments that were being dragged and clears list
-        if self.items_being_dragged:
-            for item in self.items_being_dragged:
-                item.mouseReleaseEvent(event, passive=True)
+        # mouse moves only schedule the refresh, however many arrive before the next paint
+        timer = self.get_refresh_timer()
+        if not timer.isActive():
+            timer.start()
+
+    def refresh_drag(self):
+        # one translation of all members per frame
+        if self._caller is None:
+            return
+        try:
+            delta = self._caller.pos() - self._drag_pos
+        except RuntimeError:
+            return  # deleted while dragging
+        if delta.isNull():
+            return
+        self._drag_pos = self._drag_pos + delta
+        moved = 0
+        for item in self.items_being_dragged:
+            try:
+                item.moveBy(delta.x(), delta.y())
+                moved += 1
+            except RuntimeError:
+                pass  # deleted by Maya while dragging
+        self.geometry_changes += moved
+        profiler.record_geometry_changes(moved)
+
+    def stop_drag(self):
+        # last translation, then members are refreshed where the comments left and landed
+        if self._caller is None:
+            return
+        self.get_refresh_timer().stop()
+        self.refresh_drag()
+        scene = self._caller.scene()
+        rects = self._drag_rects + [comment.get_scene_content_rect() for comment in self._drag_comments]
+        self._caller = self._drag_pos = None
+        self._drag_comments = []
+        self._drag_rects = []
         self.items_being_dragged = []
+        update_memberships(scene, rects)
 
 class NEPNodeAligner():
+    def get_rect(self, node):
+        # comments paint their label above the body, only the body is aligned
+        if isinstance(node, NEPComment):
+            return node.content_rect
+        return node.boundingRect()
+
     def startAlign(self, comment):
         #print("START")
-        children = comment.childItems() # cache
-        colliding_items = comment.collidingItems()
-        if colliding_items:
-            for item in colliding_items:
-                item_type = type(item)
-                if item_type == QGraphicsItem or item_type == NEPImage:
-                    if item not in children:
-                        if item_type == NEPImage:
-                            if not item.is_pinned:
-                                comment.add_child(item)
-                        else: # this is a native Maya node
-                            if not bool(item.flags() & QGraphicsItem.ItemIsFocusable): # skip searchbox
-                                comment.add_child(item)
+        comment.begin_drag(set())
 
     def stopAlign(self, comment):
         #print("STOP")
-        children = comment.childItems()
-        if children:
-            # hack to refresh C++ objects everytime children count change
-            # so we're not pointing to objects that got deleted
-            while True:
-                children = comment.childItems()
-                can_exit = True
-                for item in children:
-                    item_type = type(item)
-                    if item_type == QGraphicsItem or item_type == NEPImage:
-                        comment.remove_child(item)
-                        can_exit = False
-                        break
-                if can_exit:
-                    break
+        comment.end_drag()
     def getFullLength(self, axis, graphicsList):
         fullLength = 0
         positionSize = 0
         for node in graphicsList:
             if axis == "x":
-                positionSize = node.pos().x() + node.boundingRect().width()
+                positionSize = node.pos().x() + self.get_rect(node).width()
                 fullLength += positionSize
             elif axis == "y":
-                positionSize = node.pos().y() + node.boundingRect().height()
+                positionSize = node.pos().y() + self.get_rect(node).height()
                 fullLength += positionSize
     
         return fullLength
@@ -438,8 +786,8 @@ class NEPNodeAligner():
            allVals = []
            values = []
            for node in graphicsList:
-               allVals.append(node.pos().x() + node.boundingRect().width())
-               allVals.append(node.pos().y() + node.boundingRect().height())
+               allVals.append(node.pos().x() + self.get_rect(node).width())
+               allVals.append(node.pos().y() + self.get_rect(node).height())
                values.append(allVals)
                allVals = []
            return values
@@ -482,14 +830,14 @@ class NEPNodeAligner():
             mRight = self.getMostRight(self.get_all_values(graphicsList))
             fLenght = mRight - mLeft
             for node in graphicsList:
-                widths += node.boundingRect().width()
+                widths += self.get_rect(node).width()
             spaceBetween = (fLenght - widths) / (len(graphicsList) - 1)
         elif axis == "y":
             mTop = self.getTop(self.get_all_positions(graphicsList))
             mBottom = self.getBottom(self.get_all_values(graphicsList))
             fLenght = mBottom - mTop
             for node in graphicsList:
-                heights += node.boundingRect().height()
+                heights += self.get_rect(node).height()
             spaceBetween = (fLenght - heights) / (len(graphicsList) - 1)
 
         return spaceBetween
@@ -552,7 +900,7 @@ class NEPNodeAligner():
             if type(node) == NEPComment:
                 #print(node, " is comment")
                 self.startAlign(node)
-            nodeCenter = node.boundingRect().width()/2
+            nodeCenter = self.get_rect(node).width()/2
             node.setPos(xValue - nodeCenter, node.pos().y())
             if type(node) == NEPComment:
                 #print(node, " is comment")
@@ -565,7 +913,7 @@ class NEPNodeAligner():
             if type(node) == NEPComment:
                 #print(node, " is comment")
                 self.startAlign(node)
-            nodeWidth = node.boundingRect().width()
+            nodeWidth = self.get_rect(node).width()
             xValue = widthValue - nodeWidth
             node.setPos(xValue, node.pos().y())
             if type(node) == NEPComment:
@@ -594,7 +942,7 @@ class NEPNodeAligner():
             if type(node) == NEPComment:
                 #print(node, " is comment")
                 self.startAlign(node)
-            nodeMiddle = node.boundingRect().height()/2
+            nodeMiddle = self.get_rect(node).height()/2
             node.setPos(node.pos().x(), yValue - nodeMiddle)
             if type(node) == NEPComment:
                 #print(node, " is comment")
@@ -608,7 +956,7 @@ class NEPNodeAligner():
             if type(node) == NEPComment:
                 #print(node, " is comment")
                 self.startAlign(node)
-            nodeHieight = node.boundingRect().height()
+            nodeHieight = self.get_rect(node).height()
             yValue = heightValue - nodeHieight
             node.setPos(node.pos().x(), yValue)
             if type(node) == NEPComment:
@@ -629,7 +977,7 @@ class NEPNodeAligner():
                 self.startAlign(node)
 
             if node != values[0]:
-                xValue = values[index].pos().x() + values[index].boundingRect().width() + spaceBetween
+                xValue = values[index].pos().x() + self.get_rect(values[index]).width() + spaceBetween
                 index+= 1
             else:
                 xValue = node.pos().x()
@@ -651,7 +999,7 @@ class NEPNodeAligner():
                 #print(node, " is comment")
                 self.startAlign(node)
             if node != values[0]:
-                yValue = values[index].pos().y() + values[index].boundingRect().height() + spaceBetween
+                yValue = values[index].pos().y() + self.get_rect(values[index]).height() + spaceBetween
                 index+= 1
             else:
                 yValue = node.pos().y()
@@ -669,10 +1017,19 @@ class NEPImage(NEPComment):
     '''
     pixmap = None
     img_index = -1 # saves img index to rebuild graph
-    def __init__(self, label, content_rect, NEP, encoded_image, bg_color=None, is_pinned=False):
+    border_color = QColor(0,0,0,0)
+    _pixmap_key = None  # content hash the pixmap is shared under, see set_pixmap
+    _block_color = None # average color drawn while zoomed out even further
+    def __init__(self, label, content_rect, NEP, encoded_image=None, bg_color=None, is_pinned=False, pixmap=None):
+        ''' Without pixmap or encoded_image the image shows a placeholder of content_rect size
+        until set_pixmap is called, see NEPImageLoader.
+        '''
         self.round_corners_size = 1
-        self.pixmap = QPixmap()
-        self.pixmap.loadFromData(base64.b64decode(encoded_image), "PNG")
+        if pixmap: # already decoded
+            self.pixmap = pixmap
+        elif encoded_image:
+            self.pixmap = QPixmap()
+            self.pixmap.loadFromData(base64.b64decode(encoded_image), "PNG")
 
         if not content_rect: # if it's being created for the first time, use the image default size
             content_rect = self.pixmap.rect()
@@ -680,9 +1037,45 @@ class NEPImage(NEPComment):
 
     def set_img_index(self, index):
         self.img_index = index
+        self._record = None
+
+    def set_pixmap(self, pixmap, pixmap_key=None):
+        ''' Swaps the placeholder for the decoded image, the saved size is kept.
+        pixmap_key is the content hash pixmap is shared under in pixmap_cache.pool, this item
+        owns one reference to it and gets evicted by pixmap_cache.residency.
+        '''
+        self.release_pixmap()
+        self.pixmap = pixmap
+        self._pixmap_key = pixmap_key
+        self._block_color = None
+        if pixmap_key:
+            pixmap_cache.residency.add(self)
+        self.update()
+
+    def release_pixmap(self):
+        # frees the decoded image, it is decoded again from the scene next time it is shown
+        if self._pixmap_key:
+            pixmap_cache.pool.release(self._pixmap_key)
+            pixmap_cache.residency.remove(self)
+        self._pixmap_key = None
+        self.pixmap = None
+
+    def delete(self):
+        self._NEP.image_loader.cancel(self)
+        self.release_pixmap()
+        super().delete()
+
+    def to_record(self):
+        return {"nep_type": "image", "img_index": self.img_index, "pos": {"x": self.pos().x(), "y": self.pos().y()},
+                "width": self.content_rect.width(), "height": self.content_rect.height(),
+                "bg_color": self.bg_color.name(), "is_pinned": self.is_pinned}
 
     # override mouse events to keep dragging working but skip all Comment-style calculations
     def mousePressEvent(self, event, passive=False):
+        if not passive and self.hit_pin(event):
+            self.toggle_pin()
+            event.accept()
+            return
         if self.is_pinned: return
         QGraphicsItem.mousePressEvent(self, event)
 
@@ -700,27 +1093,62 @@ class NEPImage(NEPComment):
         # passive flag left there just in case to prevent errors
         QGraphicsItem.mouseReleaseEvent(self, event)
 
-        # if released while resizing, update manhattanlength
+        # if released while resizing, update manhattanlength and the comments around
         if self.is_showing_resize_cursor:
             self.update_manhattan_length()
+            update_memberships(self.scene(), [self.get_scene_content_rect()])
 
         # don't move update anything if pinned, can't drag anyway
         if self.is_pinned: return
 
+    def get_scaled_pixmap(self, lod):
+        # nearest pre-scaled level for the size the image takes on screen, see pixmap_cache
+        return pixmap_cache.mipmaps.get_for_size(self.pixmap, self.content_rect.width() * lod)
+
+    def paint_placeholder(self, painter):
+        # still decoding, reserves the saved size so nothing jumps once the image arrives
+        painter.setPen(self._pen)
+        painter.setBrush(COLOR_PLACEHOLDER)
+        painter.drawRect(self.content_rect)
+
+    def get_block_color(self):
+        if self._block_color is None:
+            self._block_color = pixmap_cache.mipmaps.get_for_size(self.pixmap, 8).toImage().scaled(
+                1, 1, Qt.IgnoreAspectRatio, Qt.SmoothTransformation).pixelColor(0, 0)
+        return self._block_color
+
     # override paint
+    @profiler.timed_paint("NEPImage")
     def paint(self, painter, option, widget):
-        if self.isSelected():
-            pen      = QPen(COLOR_SELECTED, 2)
-        else:
-            pen      = QPen(QColor(0,0,0,0), 2)
-
-        path = QPainterPath()
-        path.addRoundedRect(self.content_rect, self.round_corners_size, self.round_corners_size)
-        
-        painter.setPen(pen)
+        lod = self.update_lod(painter, option)
+        if self._paint_path is None:
+            self.update_paint_cache()
+
+        if self.pixmap is None:
+            # on screen for the first time or released while off screen
+            self._NEP.image_loader.request_item(self)
+            self.paint_placeholder(painter)
+            return
+        pixmap_cache.residency.touch(self)
+
+        if lod < LOD_DETAIL:
+            if lod < LOD_BLOCK:
+                painter.fillRect(self.content_rect, self.get_block_color())
+            else:
+                scaled = self.get_scaled_pixmap(lod)
+                painter.drawPixmap(self.content_rect, scaled, QRectF(scaled.rect()))
+            if self.isSelected():
+                painter.setPen(self._pen)
+                painter.drawRect(self.content_rect)
+            return
+
+        painter.setPen(self._pen)
         #painter.fillPath(path, self.bg_color )
-        painter.drawPath(path)
-        painter.drawPixmap(self.content_rect, self.pixmap, self.pixmap.rect())
+        painter.drawPath(self._paint_path)
+        scaled = self.get_scaled_pixmap(lod)
+        painter.drawPixmap(self.content_rect, scaled, QRectF(scaled.rect()))
+        if self.painted_header:
+            self.paint_header(painter)
 
 class NEPSearchBox(QDialog):
     initial_width  = 450
@@ -0,0 +1,49 @@
+import os, shutil
+from PySide2.QtGui import QImage
+from PySide2.QtCore import Qt, QByteArray, QBuffer, QIODevice
+from node_editor_plus import image_store
+
+PNG_QUALITY = 0  # for PNG Qt maps quality to zlib compression, 0 is the smallest file
+
+
+def encode_png(image):
+    buffer = QByteArray()
+    device = QBuffer(buffer)
+    device.open(QIODevice.WriteOnly)
+    image.save(device, "PNG", PNG_QUALITY)
+    device.close()
+    return bytes(buffer.data())
+
+
+def normalize_image(image_data, max_size=0):
+    ''' Prepares the bytes of a PNG file to be embedded in the scene: images larger than
+    max_size pixels on either side (0 to keep any size) are downscaled, and the result is
+    recompressed. The original bytes are kept when recompressing alone doesn't make them smaller.
+    Returns (png bytes to store, QImage of them), None if image_data isn't a valid PNG.
+    Doesn't touch Maya or any widget so it can run on a worker thread.
+    '''
+    image = QImage()
+    if not image.loadFromData(image_data, "PNG"):
+        return None
+
+    scaled = False
+    if max_size > 0 and max(image.width(), image.height()) > max_size:
+        image = image.scaled(max_size, max_size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        scaled = True
+
+    data = encode_png(image)
+    if not scaled and len(data) >= len(image_data):
+        data = image_data  # the file was already tighter than what we write
+    return data, image
+
+
+def save_original(image_data, source_path, folder):
+    ''' Copies the file being imported to folder, named after its content so the same file is
+    only kept once. Returns the path of the copy.
+    '''
+    os.makedirs(folder, exist_ok=True)  # several imports may get here at once
+    extension = os.path.splitext(source_path)[1] or ".png"
+    path = os.path.join(folder, image_store.hash_image_data(image_data) + extension)
+    if not os.path.exists(path):
+        shutil.copyfile(source_path, path)
+    return path
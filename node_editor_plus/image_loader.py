@@ -0,0 +1,178 @@
+from PySide2.QtGui import QPixmap, QImage
+from PySide2.QtCore import QObject, QRunnable, QThreadPool, QThread, QTimer, Signal
+from node_editor_plus import image_store
+from node_editor_plus import pixmap_cache
+from node_editor_plus import custom_nodes
+
+PREFETCH_MARGIN = 0.5  # fraction of the viewport size around it where images are decoded ahead
+
+
+class NEPDecodeSignals(QObject):
+    # lives in the main thread so finished is delivered there
+    finished = Signal(int, QImage)
+
+
+class NEPDecodeJob(QRunnable):
+    # decodes one payload read by NEPImageSession.read_payload
+    def __init__(self, job_id, payload, signals):
+        super().__init__()
+        # owned by NEPImageLoader._jobs, the pool must not delete a finished job that
+        # cancel_job may still hand to tryTake before its finished signal is handled
+        self.setAutoDelete(False)
+        self.job_id = job_id
+        self.payload = payload
+        self.signals = signals
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            return
+        image = image_store.decode_payload(self.payload)
+        if self.cancelled:
+            return
+        self.signals.finished.emit(self.job_id, image if image is not None else QImage())
+
+
+class NEPImageLoader(QObject):
+    ''' Decodes NEPImage pixmaps off the main thread.
+    Slots are read from the scene on the main thread (Maya isn't thread safe), the PNG decode to
+    QImage runs on a QThreadPool and the QPixmap is created and handed to the items back on the
+    main thread. Items show a placeholder with their saved size meanwhile. Items requesting a
+    slot that is already being decoded wait for that same job. Jobs are cancelled once every
+    item waiting for them was deleted, e.g. when the tab is cleared.
+    Images are only requested once they are painted or come within PREFETCH_MARGIN of a
+    watched view, and their pixmaps are released again by pixmap_cache.residency.
+    '''
+    _NEP = None
+    _next_job_id = 0
+    _session = None
+
+    def __init__(self, NEP):
+        super().__init__()
+        self._NEP = NEP
+        self._jobs = {}       # {job id: (NEPDecodeJob, slot, content hash, [items])}
+        self._slot_jobs = {}  # {slot: job id} of jobs still running
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(QThread.idealThreadCount() - 1, 1))  # leave a core to Maya
+        self._signals = NEPDecodeSignals()
+        self._signals.finished.connect(self.on_decoded)
+        self._item_jobs = {}  # {item: job id} of items waiting for a job, so cancel doesn't scan _jobs
+        self._watched_views = []
+        self._prefetch_views = set()
+
+    def get_session(self):
+        # reused across requests until the storage changes
+        if self._session is None or self._session.generation != self._NEP.img_store.generation:
+            self._session = self._NEP.img_store.open_session()
+        return self._session
+
+    def request_item(self, item):
+        # decodes item's img_index unless it is already on its way
+        if item not in self._item_jobs:
+            self.request(item, self.get_session(), item.img_index)
+
+    def request(self, item, session, slot):
+        # item.set_pixmap is called once slot is decoded, right away if it is in the pool
+        pixmap_key = self._NEP.img_store.get_slot_hash(slot)
+        pixmap = pixmap_cache.pool.acquire(pixmap_key)
+        if pixmap is not None:
+            item.set_pixmap(pixmap, pixmap_key)
+            return
+
+        if slot in self._slot_jobs:
+            job_id = self._slot_jobs[slot]
+            self._jobs[job_id][3].append(item)
+            self._item_jobs[item] = job_id
+            return
+
+        payload = session.read_payload(slot)
+        if payload is None:
+            item.set_pixmap(self._NEP.get_not_found_pixmap())
+            return
+
+        job_id = self._next_job_id
+        self._next_job_id += 1
+        job = NEPDecodeJob(job_id, payload, self._signals)
+        self._jobs[job_id] = (job, slot, pixmap_key, [item])
+        self._slot_jobs[slot] = job_id
+        self._item_jobs[item] = job_id
+        self._pool.start(job)
+
+    def on_decoded(self, job_id, image):
+        entry = self._jobs.pop(job_id, None)
+        if entry is None:
+            return  # cancelled while decoding
+        job, slot, pixmap_key, items = entry
+        del self._slot_jobs[slot]
+        for item in items:
+            del self._item_jobs[item]
+
+        if image.isNull():
+            pixmap, pixmap_key = self._NEP.get_not_found_pixmap(), None
+        else:
+            pixmap = QPixmap.fromImage(image)
+        for item in items:
+            try:
+                if pixmap_key:
+                    item.set_pixmap(pixmap_cache.pool.insert(pixmap_key, pixmap), pixmap_key)
+                else:
+                    item.set_pixmap(pixmap)
+            except RuntimeError:
+                pixmap_cache.pool.release(pixmap_key)  # deleted by Maya behind our back
+
+    def cancel(self, item):
+        # item doesn't need its pixmap anymore, drops the job if nobody else is waiting for it
+        job_id = self._item_jobs.pop(item, None)
+        if job_id is None:
+            return
+        items = self._jobs[job_id][3]
+        items.remove(item)
+        if not items:
+            self.cancel_job(job_id)
+
+    def cancel_job(self, job_id):
+        job, slot, pixmap_key, items = self._jobs.pop(job_id)
+        del self._slot_jobs[slot]
+        for item in items:
+            del self._item_jobs[item]
+        job.cancelled = True
+        self._pool.tryTake(job)  # not started yet, never runs
+
+    def cancel_all(self, *args):
+        # slots belong to the scene they were read from
+        for job_id in list(self._jobs):
+            self.cancel_job(job_id)
+        self._session = None
+
+    def watch_view(self, view):
+        # decodes images coming close to the viewport of view while it is scrolled or zoomed
+        if view in self._watched_views:
+            return
+        self._watched_views.append(view)
+        for scrollbar in [view.horizontalScrollBar(), view.verticalScrollBar()]:
+            scrollbar.valueChanged.connect(lambda *args, view=view: self.schedule_prefetch(view))
+        self.schedule_prefetch(view)
+
+    def schedule_prefetch(self, view):
+        # coalesces all scroll events of a frame into a single query
+        if not self._prefetch_views:
+            QTimer.singleShot(0, self.run_prefetch)
+        self._prefetch_views.add(view)
+
+    def run_prefetch(self):
+        views, self._prefetch_views = self._prefetch_views, set()
+        for view in views:
+            try:
+                self.prefetch(view)
+            except RuntimeError:
+                self._watched_views.remove(view)  # tab was closed
+
+    def prefetch(self, view):
+        if not view.isVisible():
+            return  # background tab
+        visible = view.mapToScene(view.viewport().rect()).boundingRect()
+        margin_x = visible.width() * PREFETCH_MARGIN
+        margin_y = visible.height() * PREFETCH_MARGIN
+        for item in view.scene().items(visible.adjusted(-margin_x, -margin_y, margin_x, margin_y)):
+            if type(item) == custom_nodes.NEPImage and item.pixmap is None:
+                self.request_item(item)
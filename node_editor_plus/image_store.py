@@ -0,0 +1,383 @@
+import json, base64, hashlib
+from maya import cmds
+from PySide2.QtGui import QImage
+from PySide2.QtCore import QByteArray
+
+# attributes on the CFG node
+LEGACY_ATTR = "IMG_LIST"    # append-only stringArray used up to v0.1.29, migrated on first write since v0.2.0
+DATA_ATTR   = "IMG_DATA"    # multi string attribute, one record per slot
+CHUNK_ATTR  = "IMG_CHUNKS"  # multi string attribute, base85 pieces of the images
+INDEX_ATTR  = "IMG_INDEX"   # json dict {content hash: slot}
+
+# a slot record is either a plain base64 PNG (older scenes, converted on save)
+# or a manifest "nep85:<byte size>:<chunk>,<chunk>,..." pointing into CHUNK_ATTR
+DENSE_PREFIX = "nep85:"
+CHUNK_CHARS  = 5 * 200000  # must be a multiple of 5 so every chunk decodes on its own
+
+
+def hash_image_data(image_data):
+    # images are addressed by the hash of their raw PNG bytes, not of their encoding
+    return hashlib.sha1(image_data).hexdigest()
+
+
+def encode_image_chunks(image_data):
+    # base85 is ~6% smaller than base64 and still safe to store in a string attribute
+    encoded = base64.b85encode(image_data).decode("ascii")
+    return [encoded[i:i + CHUNK_CHARS] for i in range(0, len(encoded), CHUNK_CHARS)]
+
+
+def is_dense_record(record):
+    return record.startswith(DENSE_PREFIX)
+
+
+def parse_dense_record(record):
+    # returns (byte size, [chunk indices])
+    size, chunks = record[len(DENSE_PREFIX):].split(":")
+    return int(size), [int(c) for c in chunks.split(",") if c]
+
+
+def decode_payload(payload):
+    ''' Decodes what NEPImageSession.read_payload returned into a QImage, None if it isn't a
+    valid PNG. Doesn't touch Maya so it can run on a worker thread. Dense chunks are appended
+    one by one to a preallocated QByteArray and legacy base64 is decoded by Qt, so the PNG
+    bytes are never assembled as a separate Python bytes object first.
+    '''
+    if payload[0] == DENSE_PREFIX:
+        size, chunks = payload[1], payload[2]
+        buffer = QByteArray()
+        buffer.reserve(size)
+        for chunk in chunks:
+            buffer.append(base64.b85decode(chunk))
+    else:
+        buffer = QByteArray.fromBase64(QByteArray(payload[1].encode("ascii")))
+
+    image = QImage()
+    if not image.loadFromData(buffer, "PNG"):
+        return None
+    return image
+
+
+def record_byte_size(record):
+    # characters a record takes in the scene, counting the chunks of dense records
+    if is_dense_record(record):
+        size = parse_dense_record(record)[0]
+        return len(record) + (size * 5 + 3) // 4
+    return len(record)
+
+
+class NEPImageStore():
+    ''' Content addressed storage for the images embedded in the scene.
+    Each image lives in its own slot of a multi attribute so adding one is a single setAttr
+    instead of rewriting the whole array, and a small hash->slot index stored next to it
+    lets identical files share the same slot. Slots are the "img_index" saved by NEPImage.
+    Image bytes are base85 encoded and split across CHUNK_ATTR so big images don't end up
+    in a single huge string.
+    '''
+    _NEP = None
+    cfg_node = None
+    _index = None       # {hash: slot}, lazily read from INDEX_ATTR
+    _next_slot = None   # cached so appends don't need to query the multi indices
+    _next_chunk = None
+    generation = 0      # bumped whenever slots are added, moved or dropped, see open_session
+    _slot_hashes = None # {slot: hash}, reverse of the index
+    _migrated = False   # migrate already ran for the current scene
+
+    def __init__(self, NEP, cfg_node):
+        self._NEP = NEP
+        self.cfg_node = cfg_node
+
+    def _attr(self, attr_name):
+        return self.cfg_node + "." + attr_name
+
+    def _slot_attr(self, slot):
+        return "{}.{}[{}]".format(self.cfg_node, DATA_ATTR, slot)
+
+    def _chunk_attr(self, chunk):
+        return "{}.{}[{}]".format(self.cfg_node, CHUNK_ATTR, chunk)
+
+    def has_attr(self, attr_name):
+        if not cmds.objExists(self.cfg_node):
+            return False
+        return cmds.attributeQuery(attr_name, node=self.cfg_node, exists=True)
+
+    def get_slots(self):
+        # existing slot numbers, sparse
+        if not self.has_attr(DATA_ATTR):
+            return []
+        return cmds.getAttr(self._attr(DATA_ATTR), multiIndices=True) or []
+
+    def get_record(self, slot):
+        return cmds.getAttr(self._slot_attr(slot)) or ""
+
+    def read_chunk(self, chunk):
+        return cmds.getAttr(self._chunk_attr(chunk)) or ""
+
+    def get_index(self):
+        if self._index is None:
+            self._index = {}
+            if self.has_attr(INDEX_ATTR):
+                data = cmds.getAttr(self._attr(INDEX_ATTR))
+                if data:
+                    self._index = json.loads(data)
+        return self._index
+
+    def get_slot_hash(self, slot):
+        # content hash of the image in slot, None if it isn't indexed
+        if self._slot_hashes is None:
+            self._slot_hashes = {s: h for h, s in self.get_index().items()}
+        return self._slot_hashes.get(slot)
+
+    def get_hash_slots(self):
+        # {content hash: slot} of every stored image, including legacy ones not migrated yet
+        hash_slots = dict(self.get_index())
+        if self.has_attr(LEGACY_ATTR):
+            for slot, encoded_image in enumerate(cmds.getAttr(self._attr(LEGACY_ATTR)) or []):
+                if encoded_image:
+                    hash_slots.setdefault(hash_image_data(base64.b64decode(encoded_image)), slot)
+        return hash_slots
+
+    def _slots_changed(self):
+        self.generation += 1
+        self._slot_hashes = None
+
+    def save_index(self):
+        self._NEP.create_nep_data(create_string_attr=INDEX_ATTR)
+        cmds.setAttr(self._attr(INDEX_ATTR), json.dumps(self.get_index()), type="string")
+
+    def reset(self):
+        # forget cached state, call when the scene changes under us
+        self._index = None
+        self._next_slot = None
+        self._next_chunk = None
+        self._migrated = False
+        self._slots_changed()
+
+    def _allocate_chunk(self):
+        created = self._NEP.create_nep_data(create_multi_string_attr=CHUNK_ATTR)
+        if created["created_attr"]:
+            self._next_chunk = 0
+        elif self._next_chunk is None:
+            existing = cmds.getAttr(self._attr(CHUNK_ATTR), multiIndices=True) or []
+            self._next_chunk = max(existing, default=-1) + 1
+        chunk = self._next_chunk
+        self._next_chunk += 1
+        return chunk
+
+    def _remove_chunks(self, record):
+        # drops the chunks a dense record points to, node must be unlocked by the caller
+        if is_dense_record(record):
+            for chunk in parse_dense_record(record)[1]:
+                cmds.removeMultiInstance(self._chunk_attr(chunk), b=True)
+
+    def _write_slot(self, slot, image_data):
+        chunks = []
+        for data in encode_image_chunks(image_data):
+            chunk = self._allocate_chunk()
+            cmds.setAttr(self._chunk_attr(chunk), data, type="string")
+            chunks.append(str(chunk))
+        record = "{}{}:{}".format(DENSE_PREFIX, len(image_data), ",".join(chunks))
+        cmds.setAttr(self._slot_attr(slot), record, type="string")
+
+    def migrate_legacy(self):
+        ''' Moves IMG_LIST into per slot storage keeping the same indices so saved img_index
+        values stay valid. Only runs once per scene, the legacy attribute is deleted afterwards.
+        Records are copied as base64, migrate_encoding converts them on save.
+        '''
+        if not self.has_attr(LEGACY_ATTR):
+            return False
+
+        legacy_array = cmds.getAttr(self._attr(LEGACY_ATTR)) or []
+        self._NEP.create_nep_data(create_multi_string_attr=DATA_ATTR)
+        index = self.get_index()
+        for slot, encoded_image in enumerate(legacy_array):
+            if not encoded_image:
+                continue  # slot cleared by an older optimize_images_data
+            cmds.setAttr(self._slot_attr(slot), encoded_image, type="string")
+            index.setdefault(hash_image_data(base64.b64decode(encoded_image)), slot)
+
+        cmds.lockNode(self.cfg_node, lock=False)
+        cmds.deleteAttr(self._attr(LEGACY_ATTR))
+        cmds.lockNode(self.cfg_node, lock=True)
+        self._next_slot = None
+        self._slots_changed()
+        self.save_index()
+        return True
+
+    def migrate_encoding(self):
+        # converts base64 records to chunked base85, returns how many were converted
+        converted = 0
+        for slot in self.get_slots():
+            record = self.get_record(slot)
+            if record and not is_dense_record(record):
+                self._write_slot(slot, base64.b64decode(record))
+                converted += 1
+        return converted
+
+    def migrate(self):
+        ''' Brings older scenes up to the current storage, called on save. Only the first call
+        per scene looks at the slots, everything written afterwards is already current.
+        '''
+        if self._migrated:
+            return 0
+        self.migrate_legacy()
+        converted = self.migrate_encoding()
+        self._migrated = True
+        return converted
+
+    def add_image(self, image_data):
+        ''' Stores raw PNG bytes and returns their slot, reusing the slot of an identical image '''
+        return self.add_images([image_data])[0]
+
+    def add_images(self, images_data):
+        ''' Stores a batch of raw PNG bytes and returns their slots in the same order. Identical
+        images share a slot, within the batch too, and the index is only written once.
+        '''
+        self.migrate_legacy()
+        index = self.get_index()
+        slots = []
+        added = False
+        for image_data in images_data:
+            image_hash = hash_image_data(image_data)
+            if image_hash in index:
+                slots.append(index[image_hash])
+                continue
+
+            if not added:
+                created = self._NEP.create_nep_data(create_multi_string_attr=DATA_ATTR)
+                if created["created_attr"]:
+                    self._next_slot = 0
+                elif self._next_slot is None:
+                    self._next_slot = max(self.get_slots(), default=-1) + 1
+                added = True
+
+            slot = self._next_slot
+            self._write_slot(slot, image_data)
+            self._next_slot += 1
+            index[image_hash] = slot
+            slots.append(slot)
+
+        if added:
+            self._slots_changed()
+            self.save_index()
+        return slots
+
+    def compact(self, live_slots):
+        ''' Packs the live slots at the start of the storage and drops everything else.
+        Returns ({old slot: new slot}, characters reclaimed). Live slots that have no data
+        map to -1 so they can't end up pointing at another image.
+        '''
+        self.migrate_legacy()
+        live_slots = set(live_slots)
+        existing = sorted(self.get_slots())
+        kept = [slot for slot in existing if slot in live_slots]
+        remap = dict.fromkeys(live_slots, -1)
+        remap.update({old_slot: new_slot for new_slot, old_slot in enumerate(kept)})
+
+        reclaimed = 0
+        cmds.lockNode(self.cfg_node, lock=False)
+        # ascending order is safe, a slot is only overwritten after it has been read
+        for slot in existing:
+            record = self.get_record(slot)
+            if slot not in live_slots:
+                reclaimed += record_byte_size(record)
+                self._remove_chunks(record)
+            elif remap[slot] != slot:
+                cmds.setAttr(self._slot_attr(remap[slot]), record, type="string")
+        for slot in existing:
+            if slot >= len(kept):
+                cmds.removeMultiInstance(self._slot_attr(slot), b=True)
+        cmds.lockNode(self.cfg_node, lock=True)
+
+        index = self.get_index()
+        self._index = {h: remap[s] for h, s in index.items() if remap.get(s, -1) >= 0}
+        self._next_slot = len(kept)
+        self._slots_changed()
+        self.save_index()
+        return remap, reclaimed
+
+    def backup(self, live_slots):
+        ''' What compact(live_slots) is going to overwrite or drop: every slot record, the
+        chunks of the slots that aren't live and the index. Pass it to restore to undo the
+        compaction, see NodeEditorPlus.optimize_images_data.
+        '''
+        live_slots = set(live_slots)
+        records = {slot: self.get_record(slot) for slot in self.get_slots()}
+        chunks = {}
+        for slot, record in records.items():
+            if slot not in live_slots and is_dense_record(record):
+                for chunk in parse_dense_record(record)[1]:
+                    chunks[chunk] = self.read_chunk(chunk)
+        index = cmds.getAttr(self._attr(INDEX_ATTR)) if self.has_attr(INDEX_ATTR) else None
+        return {"records": records, "chunks": chunks, "index": index}
+
+    def restore(self, backup):
+        # puts the storage back as it was when backup was taken and forgets cached state
+        cmds.lockNode(self.cfg_node, lock=False)
+        for slot in self.get_slots():
+            if slot not in backup["records"]:
+                cmds.removeMultiInstance(self._slot_attr(slot), b=True)
+        for slot, record in backup["records"].items():
+            cmds.setAttr(self._slot_attr(slot), record, type="string")
+        for chunk, data in backup["chunks"].items():
+            cmds.setAttr(self._chunk_attr(chunk), data, type="string")
+        if backup["index"] is not None:
+            cmds.setAttr(self._attr(INDEX_ATTR), backup["index"], type="string")
+        cmds.lockNode(self.cfg_node, lock=True)
+        self.reset()
+
+    def open_session(self):
+        # use one session per load so the storage is only queried once, sessions opened
+        # before the current generation may not know about every slot
+        return NEPImageSession(self)
+
+
+class NEPImageSession():
+    ''' Read access to the image store for the duration of a load.
+    Slots are fetched one at a time (or the legacy array once), so a tab or bookmark with N
+    images costs N slot reads instead of N full array copies. Payloads are decoded by
+    NEPImageLoader, see read_payload.
+    '''
+    store = None
+    generation = 0
+    _slots = None         # existing slots of DATA_ATTR, queried once
+    _legacy_array = None  # IMG_LIST of not yet migrated scenes, read once
+
+    def __init__(self, store):
+        self.store = store
+        self.generation = store.generation
+
+    def get_slots(self):
+        if self._slots is None:
+            self._slots = set(self.store.get_slots())
+        return self._slots
+
+    def get_legacy_array(self):
+        if self._legacy_array is None:
+            self._legacy_array = []
+            if self.store.has_attr(LEGACY_ATTR):
+                self._legacy_array = cmds.getAttr(self.store._attr(LEGACY_ATTR)) or []
+        return self._legacy_array
+
+    def get_record(self, slot):
+        # returns the record stored in slot, an empty string if there is nothing there
+        if slot is None or slot < 0:
+            return ""
+        if slot in self.get_slots():
+            return self.store.get_record(slot)
+        legacy_array = self.get_legacy_array()
+        if slot < len(legacy_array):
+            return legacy_array[slot] or ""
+        return ""
+
+    def read_payload(self, slot):
+        ''' Reads everything needed to decode slot from the scene, None if it is empty.
+        Must run on the main thread, the result is decoded by decode_payload anywhere:
+        (DENSE_PREFIX, byte size, [base85 chunks]) or ("base64", record)
+        '''
+        record = self.get_record(slot)
+        if not record:
+            return None
+        if is_dense_record(record):
+            size, chunks = parse_dense_record(record)
+            return DENSE_PREFIX, size, [self.store.read_chunk(chunk) for chunk in chunks]
+        return "base64", record
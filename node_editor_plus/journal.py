@@ -0,0 +1,180 @@
+import os, json, time, hashlib, threading
+from maya import cmds
+from PySide2.QtCore import QObject, QTimer
+from node_editor_plus import nep_codec
+
+JOURNAL_VERSION = 2  # 2: images are saved with their content hash, see NEPJournal.get_image_hashes
+JOURNAL_EXTENSION = ".nepj"
+
+
+def get_journal_dir():
+    return os.path.join(cmds.internalVar(userAppDir=True), "node_editor_plus", "journal")
+
+
+def get_journal_path(journal_dir, scene_path):
+    # one journal per scene file, untitled scenes have none, see NEPJournal.tick
+    name = "{}_{}".format(os.path.splitext(os.path.basename(scene_path))[0],
+                          hashlib.sha1(scene_path.encode("utf-8")).hexdigest()[:8])
+    return os.path.join(journal_dir, name + JOURNAL_EXTENSION)
+
+
+def write_atomic(path, data):
+    # readers either see the previous journal or the new one, never half of it
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as journal_file:
+        journal_file.write(data)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+    os.replace(tmp_path, path)
+
+
+class NEPJournal(QObject):
+    ''' Crash-safe autosave of the NEP document, independent from the scene file.
+    Every tick the item state is snapshotted on the main thread (only tabs changed since the
+    last journal entry are serialized again, and items cache their own records) and handed
+    to a worker thread that encodes it and writes it atomically next to Maya's prefs.
+    The journal is removed once Maya saves the scene, so one found on launch means
+    annotations were lost and can be recovered.
+    Untitled scenes are not journaled: nothing tells two of them apart, so their journal could
+    only ever be offered to an unrelated scene.
+    Images are journaled with the content hash of their slot, slots are renumbered on launch
+    by optimize_images_data so the scene file may still use another layout after a crash.
+    '''
+    interval = 5000  # ms
+    _NEP = None
+    _worker = None
+    _written_paths = None  # scene paths journaled since the current scene was opened
+    journal_dir = None     # queried once, the worker thread can't ask Maya for it
+
+    def __init__(self, NEP, journal_dir=None):
+        super().__init__()
+        self._NEP = NEP
+        self.journal_dir = journal_dir or get_journal_dir()
+        self._written_paths = set()
+        self._lock = threading.Lock()
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.interval)
+        self._timer.timeout.connect(self.tick)
+
+    def start(self):
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        if self._worker:
+            self._worker.join()
+
+    def get_scene_path(self):
+        return cmds.file(query=True, sceneName=True) or ""
+
+    def get_path(self, scene_path):
+        return get_journal_path(self.journal_dir, scene_path)
+
+    def get_image_hashes(self, document):
+        # {img_index: content hash} of the images in document, keys are strings like json writes them
+        img_store = self._NEP.img_store
+        return {str(item["img_index"]): img_store.get_slot_hash(item["img_index"])
+                for item in nep_codec.iter_image_records(document)}
+
+    def resolve_images(self, document, image_hashes):
+        ''' Points the images of a recovered document at the slots their content has in the scene
+        as it was opened, images that aren't stored there anymore get -1 (not found).
+        '''
+        hash_slots = self._NEP.img_store.get_hash_slots()
+        for item in nep_codec.iter_image_records(document):
+            item["img_index"] = hash_slots.get(image_hashes.get(str(item["img_index"])), -1)
+        return document
+
+    def tick(self):
+        if self._worker and self._worker.is_alive():
+            return  # previous write still going, changes stay dirty for the next tick
+        scene_path = self.get_scene_path()
+        if not scene_path:
+            return  # untitled, changes stay dirty until it is saved somewhere
+        try:
+            document = self._NEP.snapshot_journal_document()
+        except RuntimeError:
+            return  # node editor is not open
+        if document is None:
+            return  # nothing changed since the last entry
+
+        image_hashes = self.get_image_hashes(document)
+
+        self._written_paths.add(scene_path)
+        self._worker = threading.Thread(target=self.write, args=(self.get_path(scene_path), scene_path, document,
+                                                                 image_hashes), daemon=True)
+        self._worker.start()
+
+    def write(self, path, scene_path, document, image_hashes):
+        # runs on the worker thread, no Maya or Qt calls in here
+        data = json.dumps({"version": JOURNAL_VERSION, "scene": scene_path, "time": time.time(),
+                           "document": nep_codec.encode_document(document), "images": image_hashes})
+        with self._lock:
+            try:
+                write_atomic(path, data)
+            except OSError as e:
+                print("Node Editor Plus: could not write journal: {}".format(e))
+
+    def read(self, scene_path=None):
+        # returns (time, document, {img_index: content hash}) of the journal of scene_path or None
+        if scene_path is None:
+            scene_path = self.get_scene_path()
+        if not scene_path:
+            return None
+        path = self.get_path(scene_path)
+        if not os.path.exists(path):
+            return None
+        with self._lock:
+            try:
+                with open(path) as journal_file:
+                    entry = json.load(journal_file)
+            except (OSError, ValueError):
+                return None
+        if entry.get("version") != JOURNAL_VERSION or entry.get("scene") != scene_path:
+            return None  # older journals only know slot numbers, which may not match the scene anymore
+        return entry["time"], nep_codec.decode_document(entry["document"]), entry["images"]
+
+    def discard(self, scene_path=None):
+        if scene_path is None:
+            scene_path = self.get_scene_path()
+        if not scene_path:
+            return
+        with self._lock:
+            try:
+                os.remove(self.get_path(scene_path))
+            except OSError:
+                pass
+
+    def discard_written(self):
+        # the scene was saved, possibly under a new name: drops every journal written for it
+        if self._worker:
+            self._worker.join()
+        for scene_path in self._written_paths | {self.get_scene_path()}:
+            self.discard(scene_path)
+        self._written_paths = set()
+
+    def reset(self, *args):
+        # another scene was opened, journals of the previous one stay for a later recovery
+        self._written_paths = set()
+
+    def offer_recovery(self):
+        ''' Asks to restore a journal newer than the scene file, returns the document to load
+        or None to load the scene as saved. Declined journals are deleted.
+        '''
+        entry = self.read()
+        if not entry:
+            return None
+        journal_time, document, image_hashes = entry
+        scene_path = self.get_scene_path()
+        if scene_path and os.path.exists(scene_path) and os.path.getmtime(scene_path) >= journal_time:
+            self.discard()  # scene was saved after the journal, nothing to recover
+            return None
+
+        message = ("Node Editor Plus found Comments and Images that were not saved with this scene\n"
+                   "(autosaved {}).\nDo you want to recover them?".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(journal_time))))
+        if cmds.confirmDialog(title="Recover Node Editor Plus data", message=message, button=["Recover", "Discard"],
+                              defaultButton="Recover", cancelButton="Discard", dismissString="Discard") == "Recover":
+            return self.resolve_images(document, image_hashes)
+        self.discard()
+        return None
@@ -0,0 +1,105 @@
+''' Single codec for everything NEP writes to NEP_DATA attributes (scene tabs and bookmarks).
+
+In memory a document is {tab name: [record, ...]} where a record is the dict every NEP version
+saved per item, ie. {"nep_type", "pos": {"x", "y"}, "width", "height", "bg_color", "is_pinned"}
+plus "label" for comments and "img_index" for images. Bookmarks use a single "bookmark" tab.
+
+On disk (version 2) every tab is stored in columns, one parallel array per field, and colors
+are indices into a palette shared by the whole document:
+    {"nep_version": 2, "palette": ["#ffffff", ...],
+     "tabs": {name: {"type": [...], "x": [...], "y": [...], "w": [...], "h": [...],
+                     "color": [...], "pinned": [...], "label": [...], "img": [...]}}}
+"label" holds the comments' labels and "img" the images' img_index, both in item order.
+Version 1 documents (plain json of the in memory layout) are read as they are.
+'''
+
+import json
+from collections import OrderedDict
+
+VERSION = 2
+TYPES = ["comment", "image"]
+
+
+def _number(value):
+    # integral floats are written as ints, positions and sizes usually are
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def encode_tab(records, palette, palette_index):
+    columns = {"type": [], "x": [], "y": [], "w": [], "h": [], "color": [], "pinned": [], "label": [], "img": []}
+    for record in records:
+        nep_type = record["nep_type"]
+        color = record["bg_color"]
+        if color not in palette_index:
+            palette_index[color] = len(palette)
+            palette.append(color)
+
+        columns["type"].append(TYPES.index(nep_type))
+        columns["x"].append(_number(record["pos"]["x"]))
+        columns["y"].append(_number(record["pos"]["y"]))
+        columns["w"].append(_number(record["width"]))
+        columns["h"].append(_number(record["height"]))
+        columns["color"].append(palette_index[color])
+        columns["pinned"].append(1 if record["is_pinned"] else 0)
+        if nep_type == "comment":
+            columns["label"].append(record["label"])
+        else:
+            columns["img"].append(record["img_index"])
+    return columns
+
+
+def decode_tab(columns, palette):
+    records = []
+    labels = iter(columns["label"])
+    images = iter(columns["img"])
+    for i, type_index in enumerate(columns["type"]):
+        nep_type = TYPES[type_index]
+        record = {"nep_type": nep_type}
+        if nep_type == "comment":
+            record["label"] = next(labels)
+        else:
+            record["img_index"] = next(images)
+        record["pos"] = {"x": columns["x"][i], "y": columns["y"][i]}
+        record["width"] = columns["w"][i]
+        record["height"] = columns["h"][i]
+        record["bg_color"] = palette[columns["color"][i]]
+        record["is_pinned"] = bool(columns["pinned"][i])
+        records.append(record)
+    return records
+
+
+def encode_document(tabs):
+    # {tab name: [record, ...]} -> string for a NEP_DATA attribute
+    palette = []
+    palette_index = {}
+    encoded_tabs = OrderedDict()
+    for tab_name, records in tabs.items():
+        encoded_tabs[tab_name] = encode_tab(records, palette, palette_index)
+    return json.dumps({"nep_version": VERSION, "palette": palette, "tabs": encoded_tabs}, separators=(",", ":"))
+
+
+def decode_document(data):
+    # string from a NEP_DATA attribute (any version) -> {tab name: [record, ...]}
+    if not data:
+        return OrderedDict()
+    document = json.loads(data, object_pairs_hook=OrderedDict)
+    if "nep_version" not in document:
+        return document  # version 1 is already the in memory layout
+
+    if document["nep_version"] > VERSION:
+        raise ValueError("NEP data version {} is newer than this Node Editor Plus".format(document["nep_version"]))
+    palette = document["palette"]
+    tabs = OrderedDict()
+    for tab_name, columns in document["tabs"].items():
+        tabs[tab_name] = decode_tab(columns, palette)
+    return tabs
+
+
+def iter_image_records(document):
+    # records of the images in every tab of a document, for code rewriting their img_index
+    for name in document:
+        for record in document[name]:
+            if record["nep_type"] == "image":
+                yield record
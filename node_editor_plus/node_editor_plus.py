@@ -1,7 +1,8 @@
-import os, json, base64, importlib
+import os, math, time, importlib, traceback
 from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
-from maya import mel, cmds, OpenMayaUI
+from maya import mel, cmds, OpenMaya, OpenMayaUI
 from shiboken2 import wrapInstance
 from PySide2.QtWidgets import *
 from PySide2.QtGui import *
@@ -9,9 +10,17 @@ from PySide2.QtCore import *
 from node_editor_plus import custom_nodes
 from node_editor_plus import overrides
 from node_editor_plus import node_connection_filter
+from node_editor_plus import image_store
+from node_editor_plus import nep_codec
+from node_editor_plus import bookmark_index
+from node_editor_plus import journal
+from node_editor_plus import image_loader
+from node_editor_plus import pixmap_cache
+from node_editor_plus import image_ingest
+from node_editor_plus import profiler
 
 # version tracking
-VERSION = "0.1.29"
+VERSION = "0.2.0"
 
 # constants
 WINDOW_NAME = "NodeEditorPlusWindow"
@@ -47,6 +56,72 @@ class NEPMousePosFilter(QObject):
         return False
 
 
+class NEPStartupPipeline(QObject):
+    ''' Runs the launch stages in order once the node editor's scene is ready.
+    Polling only starts once Maya went through its deferred queue (the editor fills the
+    current tab from there), then the scene is ready when its view is visible and its item
+    count stayed the same for stable_polls polls in a row, meaning Maya finished populating
+    it. An empty scene has to stay empty just as long. Every stage is timed, including the
+    wait itself, so we can see where the time to first interaction goes.
+    '''
+    poll_interval = 20  # ms
+    stable_polls = 5    # polls with the same item count before the scene counts as populated
+    timeout = 10.0      # seconds, run the stages anyway after this
+    def __init__(self, NEP, stages):
+        super().__init__()
+        self._NEP = NEP
+        self.stages = list(stages)  # [(name, function)]
+        self.timings = OrderedDict()
+        self._last_item_count = None
+        self._stable_count = 0
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.poll_interval)
+        self._timer.timeout.connect(self.poll)
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        cmds.evalDeferred(self._timer.start, lowestPriority=True)
+
+    def is_ready(self):
+        try:
+            scene = getCurrentScene(self._NEP.node_editor)
+        except (RuntimeError, AttributeError):
+            return False  # editor widgets not built yet
+        if not scene or not scene.views() or not scene.views()[0].isVisible():
+            return False
+        item_count = len(scene.items())
+        if item_count == self._last_item_count:
+            self._stable_count += 1
+        else:
+            self._stable_count = 0
+        self._last_item_count = item_count
+        return self._stable_count >= self.stable_polls
+
+    def poll(self):
+        waited = time.perf_counter() - self._start_time
+        if not self.is_ready() and waited < self.timeout:
+            return
+        self._timer.stop()
+        if waited >= self.timeout:
+            cmds.warning("Node Editor Plus: node editor not ready after {}s, loading anyway".format(self.timeout))
+        self.timings["wait_for_scene"] = waited
+        self.run_next_stage()
+
+    def run_next_stage(self):
+        if not self.stages:
+            self.timings["total"] = time.perf_counter() - self._start_time
+            return
+        name, function = self.stages.pop(0)
+        stage_start = time.perf_counter()
+        try:
+            function()
+        except Exception:
+            cmds.warning("Node Editor Plus: startup stage '{}' failed\n{}".format(name, traceback.format_exc()))
+        self.timings[name] = time.perf_counter() - stage_start
+        # give the UI a chance to breathe between stages
+        QTimer.singleShot(0, self.run_next_stage)
+
+
 class NodeEditorPlus():
     node_editor = None
     icons_path = ""
@@ -54,19 +129,42 @@ class NodeEditorPlus():
     _mouse_pos_filter = None
     mouse_pos = None
     grid_snap = False
+    _dirty_scenes = None   # scenes with changes that were not saved yet
+    _saved_tabs = None     # {scene: items list} of the last save, reused for clean tabs
+    _saved_document = None
+    _pending_tabs = None   # {tab page widget: records} of tabs not hydrated yet
+    _journal_dirty_scenes = None  # same as _dirty_scenes but since the last journal entry
+    _journal_tabs = None
+    _recovered_document = None   # journal document accepted on launch, loaded instead of NEP_DATA
+    _save_callback_id = None
+    _after_save_callback_id = None
+    _startup_pipeline = None
+    _profiler_hud = None
+    _membership_filter = None
 
     def __init__(self):
         # manager to propagate drags between our custom nodes
         self._drag_manager = custom_nodes.NEPDragManager()
+        self._membership_filter = custom_nodes.NEPMembershipFilter()
         self.aligner = custom_nodes.NEPNodeAligner()
+        self.img_store = image_store.NEPImageStore(self, NODE_EDITOR_CFG)
+        self.bookmarks = bookmark_index.NEPBookmarkIndex()
+        self.journal = journal.NEPJournal(self)
+        self.image_loader = image_loader.NEPImageLoader(self)
         self.icons_path = os.path.join(os.path.dirname(__file__), "icons")
         self.initialize_suppress_file_info()
+        self.reset_saved_state()
 
     def tab_change_callback(self):
         """ force new tabs to also recognize our hotkeys, this is weird since there is only 1 node editor
         but hotkeys only work in the first tab otherwise """
         cmds.nodeEditor(self.node_editor, edit=True, keyPressCommand=self.comment_key_callback)
 
+        # tabs are loaded the first time they are shown
+        self.hydrate_current_tab()
+        if self._profiler_hud:
+            self.show_profiler_hud()  # follow the current tab
+
         # intercept for our needs then call original callback
         parent = cmds.setParent(query=True)
         showMenu = None  # this doesn't seem it's being used at all in the function
@@ -111,18 +209,34 @@ class NodeEditorPlus():
         cmds.nodeEditor(self.node_editor, edit=True, allowTabTearoff=False)
         # intercept hotkeys for our functionality
         cmds.nodeEditor(self.node_editor, edit=True, keyPressCommand=self.comment_key_callback)
-        # in case we need to intercept these too, but atm it's not doing anything (v0.1.4)
+        # keeps our hotkeys working in every tab and hydrates tabs on first activation
         cmds.nodeEditor(self.node_editor, edit=True, tabChangeCommand=self.tab_change_callback)
         # intercept original callbacks, there are important so we can apply grid snapping for example
         cmds.nodeEditor(self.node_editor, edit=True, settingsChangedCallback=self.settings_changed_callback)
 
         cmds.showWindow(WINDOW_NAME)
 
-        # optimize images on launch
-        self.optimize_images_data()
-        # hack to not crash Maya, check for other ways
-        QTimer.singleShot(500, self.load_nep_data_from_scene)
-        # print(self.node_editor)
+        # decoded images are released past this many MB, see pixmap_cache.NEPPixmapResidency
+        pixmap_cache.residency.budget = self.get_pixmap_budget() * 1024 * 1024
+
+        # cached image index belongs to the scene it was read from
+        for event in ["SceneOpened", "NewSceneOpened"]:
+            cmds.scriptJob(event=[event, self.img_store.reset], parent=WINDOW_NAME)
+            cmds.scriptJob(event=[event, self.image_loader.cancel_all], parent=WINDOW_NAME)
+            cmds.scriptJob(event=[event, self.reset_saved_state], parent=WINDOW_NAME)
+            cmds.scriptJob(event=[event, self.bookmarks.invalidate], parent=WINDOW_NAME)
+            cmds.scriptJob(event=[event, self.journal.reset], parent=WINDOW_NAME)
+        self._save_callback_id = OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kBeforeSave,
+                                                                    self.before_scene_save_callback)
+        self._after_save_callback_id = OpenMaya.MSceneMessage.addCallback(OpenMaya.MSceneMessage.kAfterSave,
+                                                                          self.after_scene_save_callback)
+
+        # load our nodes once the editor is actually ready, see self.startup_timings()
+        self._startup_pipeline = NEPStartupPipeline(self, [("recover_journal", self.recover_journal),
+                                                           ("optimize_images", self.optimize_images_data),
+                                                           ("load_nep_data", self.load_nep_data_from_scene)])
+        self._startup_pipeline.start()
+        self.journal.start()
 
         # tracks mouse position on certain actions like graphing in/out connections
         # UNUSED (as of v0.1.15)
@@ -137,6 +251,16 @@ class NodeEditorPlus():
         overrides.decorate_bookmarks_functions(self)
         overrides.add_extra_option(self)
 
+    def image_cache_stats(self):
+        # {"pixmaps", "references", "bytes", "hits", "misses"} of the decoded images shared by all tabs
+        return pixmap_cache.pool.get_stats()
+
+    def startup_timings(self):
+        # {stage: seconds} of the last launch
+        if not self._startup_pipeline:
+            return OrderedDict()
+        return self._startup_pipeline.timings
+
     def initialize_suppress_file_info(self):
         # creates it as false if not existing when editor launches
         val = cmds.fileInfo("NEP_suppress_confirm_dialogs", query=True)
@@ -233,6 +357,9 @@ class NodeEditorPlus():
         elif mods == 4 and key_pressed == "I":
             self.pick_new_image()
             return True
+        elif mods == 5 and key_pressed == "I":
+            self.pick_image_folder()
+            return True
         # search comments
         elif mods == 4 and key_pressed == "F":
             self.show_search_menu()
@@ -329,7 +456,10 @@ class NodeEditorPlus():
         self.toolbar_add_button(self.left_toolbar, "Delete Item (Del)", "comment_remove.svg", self.delete_item)
         self.toolbar_add_button(self.left_toolbar, "Change Comment Color (B)", "comment_color.svg", self.color_comment)
         self.toolbar_add_button(self.left_toolbar, "Add Image to Graph (Ctrl+I)", "image_add.svg", self.pick_new_image)
+        self.toolbar_add_button(self.left_toolbar, "Add Folder of Images to Graph (Ctrl+Shift+I)", ":/fileOpen.png",
+                                self.pick_image_folder)
         self.toolbar_add_button(self.left_toolbar, "Search Comments (Ctrl+F)", ":/search.png", self.show_search_menu)
+        self.toolbar_add_button(self.left_toolbar, "Toggle Performance HUD", "hud_toggle.svg", self.toggle_profiler_hud)
 
         # align buttons
         self.left_toolbar.addSeparator()
@@ -360,6 +490,23 @@ class NodeEditorPlus():
         alignNode = True
         self.horizontal_main_layout.addWidget(nodeEdPane)
 
+    def toggle_profiler_hud(self):
+        if self._profiler_hud:
+            self.hide_profiler_hud()
+        else:
+            self.show_profiler_hud()
+
+    def show_profiler_hud(self):
+        # frame, paint, drag and operation timings drawn over the current view, see profiler
+        self.hide_profiler_hud()
+        self._profiler_hud = profiler.NEPProfilerHUD(getCurrentView(self.node_editor))
+        self._profiler_hud.start()
+
+    def hide_profiler_hud(self):
+        if self._profiler_hud:
+            self._profiler_hud.stop()
+            self._profiler_hud = None
+
     def show_search_menu(self):
         scene = getCurrentScene(self.node_editor)
         comments_list = []
@@ -378,6 +525,7 @@ class NodeEditorPlus():
         view.resetTransform()  # resets zoom level to default
         view.centerOn(item)
 
+    @profiler.timed_operation("align")
     def alignNodes(self, alignIn):
         selected_items = self.get_selected_items()
         if not selected_items:
@@ -400,6 +548,7 @@ class NodeEditorPlus():
             self.aligner.horizontalDistribute(selected_items)
         elif alignIn == "vertical":
             self.aligner.verticalDistribute(selected_items)
+        custom_nodes.update_memberships(getCurrentScene(self.node_editor))
 
     def hide_default_HUD_message(self):
         cmds.nodeEditor(self.node_editor, edit=True, hudMessage=("", 3, 0))
@@ -481,6 +630,7 @@ class NodeEditorPlus():
                     com = custom_nodes.NEPComment("", final_rect, self)
                     scene.addItem(com)
                     com.setPos(final_rect.x(), final_rect.y())
+                    custom_nodes.update_memberships(scene, [com.get_scene_content_rect()])
         else:
             # if nothing selected and no items in scene, remove the default HUD message
             if not scene.items():
@@ -491,85 +641,207 @@ class NodeEditorPlus():
             view = getCurrentView(self.node_editor)
             center = view.mapToScene(view.viewport().rect().center())
             com.setPos(center.x() - 75, center.y() - 25)
+            custom_nodes.update_memberships(scene, [com.get_scene_content_rect()])
 
     def pick_new_image(self):
-        image_path = QFileDialog.getOpenFileName(parent=None, caption='Please select an image file', filter="*.png")
-        if not image_path[0]:
+        image_paths = QFileDialog.getOpenFileNames(parent=None, caption='Please select image files', filter="*.png")
+        if image_paths[0]:
+            self.import_images(image_paths[0])
+
+    def pick_image_folder(self):
+        folder = QFileDialog.getExistingDirectory(parent=None, caption='Please select a folder of images')
+        if not folder:
+            return
+        image_paths = [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(".png")]
+        if not image_paths:
+            cmds.warning("No PNG files found in {}".format(folder))
             return
+        self.import_images(image_paths)
 
+    def import_images(self, image_paths):
+        ''' Reads and normalizes the files on worker threads (see image_ingest), then stores all of
+        them in a single write and lays them out in a grid around the center of the view.
+        '''
+        max_size = self.get_image_max_size()
+        originals_dir = self.get_image_originals_dir() if self.get_keep_image_originals() else None
+
+        def ingest(image_path):
+            # worker thread, no Maya calls in here
+            try:
+                with open(image_path, 'rb') as image_file:
+                    image_data = image_file.read()
+                result = image_ingest.normalize_image(image_data, max_size)
+                if result is None:
+                    return None
+                if originals_dir and result[0] is not image_data:
+                    image_ingest.save_original(image_data, image_path, originals_dir)
+                return len(image_data), result[0], result[1]
+            except (OSError, IOError):
+                return None
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            encoded_image = None
-            with open(image_path[0], 'rb') as image_file:
-                encoded_image = base64.b64encode(image_file.read())
-
-            if encoded_image:
-                attr_name = "IMG_LIST"
-                create_dict = self.create_nep_data(create_string_array_attr=attr_name)
-                if create_dict["created_attr"]:
-                    old_array = []
-                    size = 0
-                else:
-                    old_array = cmds.getAttr(NODE_EDITOR_CFG + "." + attr_name)
-                    size = len(old_array)
-                new_array = old_array + [encoded_image]
-
-                cmds.setAttr(NODE_EDITOR_CFG + "." + attr_name, size + 1, *new_array, type="stringArray")
+            with ThreadPoolExecutor(max_workers=max(QThread.idealThreadCount() - 1, 1)) as executor:
+                results = list(executor.map(ingest, image_paths))
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        for image_path, result in zip(image_paths, results):
+            if result is None:
+                cmds.warning("Could not load image: {}".format(image_path))
+        results = [result for result in results if result]
+        if not results:
+            cmds.error("Could not load any of the selected images")
+
+        # identical files share the same slot
+        img_indices = self.img_store.add_images([stored_data for size, stored_data, image in results])
+        positions = self.get_grid_positions([image.size() for size, stored_data, image in results])
+        for (size, stored_data, image), img_index, pos in zip(results, img_indices, positions):
+            self.create_image(pixmap=QPixmap.fromImage(image), img_index=img_index, pos=pos)
+        if originals_dir:
+            print("Node Editor Plus: original images kept in {}".format(originals_dir))
+        self.report_ingest([(size, len(stored_data)) for size, stored_data, image in results])
+
+    def get_grid_positions(self, sizes, spacing=40):
+        # top left corners of a grid of items of the given sizes centered on the view, row by row
+        columns = int(math.ceil(math.sqrt(len(sizes))))
+        rows = [sizes[i:i + columns] for i in range(0, len(sizes), columns)]
+        column_widths = [max(row[c].width() for row in rows if c < len(row)) for c in range(columns)]
+        row_heights = [max(s.height() for s in row) for row in rows]
+        width = sum(column_widths) + spacing * (columns - 1)
+        height = sum(row_heights) + spacing * (len(rows) - 1)
 
-                self.create_image(encoded_image=encoded_image, img_index=size)
-        except:
-            cmds.error("Could not load image: {}".format(image_path[0]))
-
-    def create_image(self, encoded_image, img_index):
+        view = getCurrentView(self.node_editor)
+        center = view.mapToScene(view.viewport().rect().center())
+        positions = []
+        y = center.y() - height / 2.0
+        for row, row_height in zip(rows, row_heights):
+            x = center.x() - width / 2.0
+            for column_width, size in zip(column_widths, row):
+                positions.append(QPointF(x, y))
+                x += column_width + spacing
+            y += row_height + spacing
+        return positions
+
+    def get_image_max_size(self):
+        # images bigger than this on either side are downscaled on import, 0 keeps them as they are
+        if not cmds.optionVar(exists="nepImageMaxSize"):
+            nepImageMaxSize = 2048
+            cmds.optionVar(intValue=["nepImageMaxSize", nepImageMaxSize])
+        else:
+            nepImageMaxSize = cmds.optionVar(query="nepImageMaxSize")
+        return nepImageMaxSize
+
+    def get_keep_image_originals(self):
+        # copies imported files to the project images folder before they get downscaled
+        if not cmds.optionVar(exists="nepImageKeepOriginals"):
+            cmds.optionVar(intValue=["nepImageKeepOriginals", 0])
+        return bool(cmds.optionVar(query="nepImageKeepOriginals"))
+
+    def get_image_originals_dir(self):
+        images_rule = cmds.workspace(fileRuleEntry="images") or "images"
+        return os.path.join(cmds.workspace(query=True, rootDirectory=True), images_rule, "node_editor_plus")
+
+    def report_ingest(self, sizes):
+        # sizes is [(file bytes, stored bytes)]
+        saved = sum(original - stored for original, stored in sizes)
+        if saved > 0:
+            print("Node Editor Plus: imported {} image(s), saved {:.1f} KB".format(len(sizes), saved / 1024.0))
+
+    def create_image(self, pixmap, img_index, pos=None):
         scene = getCurrentScene(self.node_editor)
         # if nothing selected and no items in scene, remove the default HUD message
         if not scene.items():
             self.hide_default_HUD_message()
 
-        img = custom_nodes.NEPImage(label="", content_rect=None, NEP=self, encoded_image=encoded_image)
+        img = custom_nodes.NEPImage(label="", content_rect=None, NEP=self, pixmap=pixmap)
         img.set_img_index(img_index)
         scene.addItem(img)
-        view = getCurrentView(self.node_editor)
-        center = view.mapToScene(view.viewport().rect().center())
-        img.setPos(center.x() - 75, center.y() - 25)
+        # share the pixmap with every other image showing the same file
+        pixmap_key = self.img_store.get_slot_hash(img_index)
+        if pixmap_key:
+            img.set_pixmap(pixmap_cache.pool.insert(pixmap_key, pixmap), pixmap_key)
+        if pos is None:
+            view = getCurrentView(self.node_editor)
+            center = view.mapToScene(view.viewport().rect().center())
+            pos = QPointF(center.x() - 75, center.y() - 25)
+        img.setPos(pos)
+        custom_nodes.update_memberships(scene, [img.get_scene_content_rect()])
+
+    def get_pixmap_budget(self):
+        if not cmds.optionVar(exists="nepPixmapBudgetMB"):
+            nepPixmapBudgetMB = 256
+            cmds.optionVar(intValue=["nepPixmapBudgetMB", nepPixmapBudgetMB])
+        else:
+            nepPixmapBudgetMB = cmds.optionVar(query="nepPixmapBudgetMB")
+        return nepPixmapBudgetMB
 
-    def get_not_found_encoded_img(self):
+    def get_not_found_pixmap(self):
         image_path = os.path.join(os.path.dirname(__file__), "img/not_found.png")
-        with open(image_path, 'rb') as image_file:
-            return base64.b64encode(image_file.read())
+        return QPixmap(image_path)
 
     def optimize_images_data(self):
-        # checks all images being used in the scene, clear binary data of unused indices
+        ''' Packs the image storage so only images used by tabs or bookmarks are kept and rewrites
+        every saved img_index to match. Runs on launch before anything is loaded, so there are
+        no NEPImage items to remap. It is housekeeping the user didn't do, so it stays out of
+        the undo queue (undoing it would point the loaded images at the wrong slots) and is
+        rolled back by hand on errors.
+        '''
         attr_name = "NEP_DATA"
-        used_indices = []
-        if cmds.objExists(
-                NODE_EDITOR_CFG):  # only do this if we have a CFG node, otherwise there are no images stored in the scene
-            if cmds.attributeQuery("IMG_LIST", node=NODE_EDITOR_CFG, exists=True):
-                if cmds.attributeQuery(attr_name, node=NODE_EDITOR_CFG, exists=True):
-                    load_dict = json.loads(cmds.getAttr(NODE_EDITOR_CFG + "." + attr_name))
-
-                    for tab_name in load_dict:
-                        for item in load_dict[tab_name]:
-                            if item["nep_type"] == "image":
-                                if not item["img_index"] in used_indices:
-                                    used_indices.append(item["img_index"])
-
-                bookmark_infos = cmds.ls(type='nodeGraphEditorBookmarkInfo')
-                if bookmark_infos:
-                    for info_node in bookmark_infos:
-                        if cmds.attributeQuery(attr_name, node=info_node, exists=True):
-                            load_dict = json.loads(cmds.getAttr(info_node + "." + attr_name))
-                            for item in load_dict["bookmark"]:
-                                if item["nep_type"] == "image":
-                                    if not item["img_index"] in used_indices:
-                                        used_indices.append(item["img_index"])
-
-                img_array = cmds.getAttr(NODE_EDITOR_CFG + ".IMG_LIST")
-                size = len(img_array)
-                for i in range(size):
-                    if i not in used_indices:
-                        img_array[i] = ""  # clear what was there
-
-                cmds.setAttr(NODE_EDITOR_CFG + ".IMG_LIST", size, *img_array, type="stringArray")
+        if not cmds.objExists(NODE_EDITOR_CFG):  # only do this if we have a CFG node, otherwise there are no images stored in the scene
+            return 0
+        if not (self.img_store.has_attr(image_store.LEGACY_ATTR) or self.img_store.has_attr(image_store.DATA_ATTR)):
+            return 0
+
+        # every document holding img_index values, tabs and bookmarks share the {name: [items]} layout
+        documents = OrderedDict()
+        if cmds.attributeQuery(attr_name, node=NODE_EDITOR_CFG, exists=True):
+            documents[NODE_EDITOR_CFG] = nep_codec.decode_document(cmds.getAttr(NODE_EDITOR_CFG + "." + attr_name))
+        for info_node in self.bookmarks.get_info_nodes():
+            documents[info_node] = self.bookmarks.get_payload(info_node)
+        if self._recovered_document:
+            documents[None] = self._recovered_document  # not saved yet but its images must survive
+
+        used_indices = {item["img_index"] for document in documents.values() for item in nep_codec.iter_image_records(document)}
+
+        undo_state = cmds.undoInfo(query=True, state=True)
+        cmds.undoInfo(stateWithoutFlush=False)
+        try:
+            self.img_store.migrate_legacy()  # keeps the legacy array until it is fully copied
+            backup = self.img_store.backup(used_indices)
+            remapped = []  # [(item, old img_index)] edited in place, cached payloads included
+            written = {}   # {node: NEP_DATA before it was rewritten}
+            try:
+                remap, reclaimed = self.img_store.compact(used_indices)
+                for node, document in documents.items():
+                    changed = False
+                    for item in nep_codec.iter_image_records(document):
+                        new_index = remap[item["img_index"]]
+                        if new_index != item["img_index"]:
+                            remapped.append((item, item["img_index"]))
+                            item["img_index"] = new_index
+                            changed = True
+                    if not changed or node is None:
+                        continue
+                    written[node] = cmds.getAttr(node + "." + attr_name)
+                    if node == NODE_EDITOR_CFG:
+                        cmds.setAttr(node + "." + attr_name, nep_codec.encode_document(document), type="string")
+                    else:
+                        self.bookmarks.set_payload(node, document)
+            except:
+                # leave storage and saved indices as they were
+                self.img_store.restore(backup)
+                for node, data in written.items():
+                    cmds.setAttr(node + "." + attr_name, data, type="string")
+                for item, old_index in remapped:
+                    item["img_index"] = old_index
+                raise
+        finally:
+            cmds.undoInfo(stateWithoutFlush=undo_state)
+
+        if reclaimed:
+            print("Node Editor Plus: packed {} images, reclaimed {:.1f} KB".format(len(used_indices), reclaimed / 1024.0))
+        return reclaimed
 
     def graph_connection(self, conn_type="output"):
         if not cmds.optionVar(exists="nepGraphLimit"):
@@ -631,6 +903,10 @@ class NodeEditorPlus():
                 item.setPos(source_item.pos().x() + (item.boundingRect().width()) * 1.5, y_offset + 20)
                 y_offset = +item.pos().y() + item.boundingRect().height()
 
+        # they were picked up where Maya added them, not where they are now
+        if dest_items:
+            custom_nodes.update_memberships(dest_items[0].scene(), [item.sceneBoundingRect() for item in dest_items])
+
     def show_connection_filter(self, plug, conn_type, conn_nodes, node_editor, parent=None):
         try:
             nep_connection_filter.close()
@@ -653,10 +929,21 @@ class NodeEditorPlus():
         overrides.restore_graph_function()
         overrides.restore_bookmarks_functions()
 
-        # custom nodes persistence
+        if self._save_callback_id is not None:
+            OpenMaya.MMessage.removeCallback(self._save_callback_id)
+            self._save_callback_id = None
+        if self._after_save_callback_id is not None:
+            OpenMaya.MMessage.removeCallback(self._after_save_callback_id)
+            self._after_save_callback_id = None
+
+        self.hide_profiler_hud()
+
+        # custom nodes persistence, the journal stays until the scene itself is saved
+        self.journal.tick()
+        self.journal.stop()
         self.save_nep_data_to_scene()
 
-    def create_nep_data(self, create_string_attr=None, create_string_array_attr=None):
+    def create_nep_data(self, create_string_attr=None, create_string_array_attr=None, create_multi_string_attr=None):
         return_dict = {"created_node": False, "created_attr": False}
         if not cmds.objExists(NODE_EDITOR_CFG):
             cmds.createNode("network", name=NODE_EDITOR_CFG)
@@ -675,88 +962,34 @@ class NodeEditorPlus():
                 cmds.addAttr(NODE_EDITOR_CFG, ln=create_string_array_attr, dataType="stringArray")
                 cmds.lockNode(NODE_EDITOR_CFG, lock=True)
                 return_dict["created_attr"] = True
+        elif create_multi_string_attr:
+            if not cmds.attributeQuery(create_multi_string_attr, node=NODE_EDITOR_CFG, exists=True):
+                cmds.lockNode(NODE_EDITOR_CFG, lock=False)
+                cmds.addAttr(NODE_EDITOR_CFG, ln=create_multi_string_attr, dataType="string", multi=True)
+                cmds.lockNode(NODE_EDITOR_CFG, lock=True)
+                return_dict["created_attr"] = True
         return return_dict
 
+    @profiler.timed_operation("save")
     def save_nep_data_to_bookmark(self, info_node=None, bookmark_name=None):
-        attr_name = "NEP_DATA"
-
-        # duplicate of original code to find the nodeGraphEditorBookmarkInfo with the given name
-        # this is used in the replace functions
+        # find the nodeGraphEditorBookmarkInfo with the given name, this is used in the replace functions
         if bookmark_name:
-            _bookmarks = []
-            bookmarkInfos = cmds.ls(type='nodeGraphEditorBookmarkInfo')
-            for bookmarkInfo in bookmarkInfos:
-                name = cmds.getAttr(bookmarkInfo + '.name')
-                if not len(name):
-                    # ignore bookmarks with null descriptions, these are likely
-                    # implicitly saved panel states
-                    continue
-                _bookmarks.append((name, bookmarkInfo))
-
-            for n, i in _bookmarks:
-                if n == bookmark_name:
-                    info_node = i
-
-        if cmds.objExists(info_node):
-            if not cmds.attributeQuery(attr_name, node=info_node, exists=True):
-                cmds.addAttr(info_node, ln=attr_name, dataType="string")
-
-            dump_dict = {}
-            dump_dict["bookmark"] = []
+            info_node = self.bookmarks.find(bookmark_name)
+
+        if info_node and cmds.objExists(info_node):
             scene = getCurrentScene(self.node_editor)
-            items_list = scene.items()
-            if items_list:
-                for item in items_list:
-                    item_type = type(item)
-                    if item_type == custom_nodes.NEPComment:
-                        dump_dict["bookmark"].append({"nep_type": "comment", "label": item.label,
-                                                      "pos": {"x": item.pos().x(), "y": item.pos().y()},
-                                                      "width": item.content_rect.width(),
-                                                      "height": item.content_rect.height(),
-                                                      "bg_color": item.bg_color.name(), "is_pinned": item.is_pinned})
-                    elif item_type == custom_nodes.NEPImage:
-                        dump_dict["bookmark"].append({"nep_type": "image", "img_index": item.img_index,
-                                                      "pos": {"x": item.pos().x(), "y": item.pos().y()},
-                                                      "width": item.content_rect.width(),
-                                                      "height": item.content_rect.height(),
-                                                      "bg_color": item.bg_color.name(), "is_pinned": item.is_pinned})
-                cmds.setAttr(info_node + "." + attr_name, json.dumps(dump_dict), type="string")
+            if scene.items():
+                self.bookmarks.set_payload(info_node, {"bookmark": self.serialize_scene_items(scene)})
             # display bookmark info
             self.set_bookmark_HUD_message(
                 "Loaded Bookmark: [{}:{}]".format(cmds.getAttr(info_node + ".name"), info_node))
 
+    @profiler.timed_operation("load")
     def load_nep_data_from_bookmark(self, info_node):
-        attr_name = "NEP_DATA"
-        load_dict = {}
-        if cmds.objExists(info_node):
-            if cmds.attributeQuery(attr_name, node=info_node, exists=True):
-                nep_data = cmds.getAttr(info_node + "." + attr_name)
-                if nep_data:
-                    load_dict = json.loads(cmds.getAttr(info_node + "." + attr_name))
-
+        load_dict = self.bookmarks.get_payload(info_node)
         if load_dict:
             scene = getCurrentScene(self.node_editor)
-            for item in load_dict["bookmark"]:
-                if item["nep_type"] == "comment":
-                    nep_item = custom_nodes.NEPComment(label=item["label"],
-                                                       content_rect=QRectF(0, 0, item["width"] - 20,
-                                                                           item["height"] - 20), NEP=self,
-                                                       bg_color=item["bg_color"], is_pinned=item["is_pinned"])
-                elif item["nep_type"] == "image":
-                    if not cmds.objExists(NODE_EDITOR_CFG) or not cmds.attributeQuery("IMG_LIST", node=NODE_EDITOR_CFG,
-                                                                                      exists=True):
-                        encoded_image = self.get_not_found_encoded_img()
-                    else:
-                        encoded_image = cmds.getAttr(NODE_EDITOR_CFG + ".IMG_LIST")[item["img_index"]]
-                    nep_item = custom_nodes.NEPImage(label="", encoded_image=encoded_image,
-                                                     content_rect=QRectF(0, 0, item["width"] - 20, item["height"] - 20),
-                                                     NEP=self, bg_color=item["bg_color"], is_pinned=item["is_pinned"])
-                    nep_item.set_img_index(item["img_index"])
-                scene.addItem(nep_item)
-
-                if item["nep_type"] == "comment":
-                    nep_item.setZValue(-1)
-                nep_item.setPos(item["pos"]["x"], item["pos"]["y"])
+            self.create_items_from_records(scene, load_dict["bookmark"])
 
         # display bookmark info
         self.set_bookmark_HUD_message("Loaded Bookmark: [{}:{}]".format(cmds.getAttr(info_node + ".name"), info_node))
@@ -766,93 +999,169 @@ class NodeEditorPlus():
         print(current_bookmark_info)
         # self.save_nep_data_to_bookmark(info_node=None, bookmark_name=None)
 
-    def save_nep_data_to_scene(self):
-        tabs_dict = OrderedDict()
-        tabs_names_list = []
+    def mark_dirty(self, scene):
+        # called by our custom nodes whenever something that gets saved changes
+        self._dirty_scenes.add(scene)
+        self._journal_dirty_scenes.add(scene)
+
+    def reset_saved_state(self, *args):
+        # forget what was saved, the scene changed under us
+        self._dirty_scenes = set()
+        self._saved_tabs = {}
+        self._saved_document = None
+        self._pending_tabs = {}
+        self._journal_dirty_scenes = set()
+        self._journal_tabs = {}
+
+    def before_scene_save_callback(self, *args):
+        # persist our nodes whenever Maya saves, not only when the window closes
+        try:
+            self.save_nep_data_to_scene()
+        except RuntimeError:
+            pass  # node editor is not open, nothing to save
+
+    def after_scene_save_callback(self, *args):
+        # everything is in the scene file now, the journal is only needed after a crash
+        # after a Save As the journal written under the previous name goes too
+        self.journal.discard_written()
+        # and the next entry starts from what was just saved, so it isn't written again unchanged
+        self._journal_tabs = dict(self._saved_tabs)
+        self._journal_dirty_scenes = set(self._dirty_scenes)
+
+    def serialize_scene_items(self, scene):
+        return [item.get_record() for item in scene.items() if type(item) in [custom_nodes.NEPComment, custom_nodes.NEPImage]]
+
+    def create_items_from_records(self, scene, records):
+        # rebuilds our custom nodes saved by serialize_scene_items
+        for record in records:
+            content_rect = QRectF(0, 0, record["width"] - 20, record["height"] - 20)
+            if record["nep_type"] == "comment":
+                nep_item = custom_nodes.NEPComment(label=record["label"], content_rect=content_rect, NEP=self,
+                                                   bg_color=record["bg_color"], is_pinned=record["is_pinned"])
+            elif record["nep_type"] == "image":
+                # decoded in the background once it gets close to the viewport, see NEPImageLoader
+                nep_item = custom_nodes.NEPImage(label="", content_rect=content_rect, NEP=self,
+                                                 bg_color=record["bg_color"], is_pinned=record["is_pinned"])
+                nep_item.set_img_index(record["img_index"])
+            else:
+                continue
+            scene.addItem(nep_item)
+
+            if record["nep_type"] == "comment":
+                nep_item.setZValue(-1)
+            nep_item.setPos(record["pos"]["x"], record["pos"]["y"])
+        custom_nodes.update_memberships(scene)
 
+    def get_tabs_widgets(self):
+        # returns the node editor (QTabBar, QStackedLayout), tab i shows page i of the stack
         ctrl = OpenMayaUI.MQtUtil.findControl(self.node_editor)
         if ctrl is None:
             raise RuntimeError("Node editor is not open")
         nodeEdPane = wrapInstance(int(ctrl), QWidget)
+        return nodeEdPane.findChild(QTabBar), nodeEdPane.findChild(QStackedLayout)
 
-        tabbar = nodeEdPane.findChild(QTabBar)
+    def snapshot_document(self, dirty_scenes, cached_tabs):
+        ''' Returns (document, {scene: records}, {tab page widget: records}) of the open tabs.
+        Only scenes in dirty_scenes or missing from cached_tabs get serialized again, the
+        others reuse their cached records.
+        '''
+        tabbar, stack = self.get_tabs_widgets()
+        dump_dict = OrderedDict()
+        tabs = {}
+        pending_tabs = {}
         for i in range(tabbar.count() - 1):  # removes +
-            tabs_names_list.append(tabbar.tabText(i))
-
-        stack = nodeEdPane.findChild(QStackedLayout)
-        for i in range(stack.count()):
-            children = stack.itemAt(i).widget().children()
-            for child in children:
-                if type(child) == QGraphicsView:
-                    valid_items_list = []
-                    for item in child.items():
-                        if type(item) in [custom_nodes.NEPComment, custom_nodes.NEPImage]:
-                            valid_items_list.append(item)
-
-                    tabs_dict[tabs_names_list[i]] = valid_items_list
-
-        dump_dict = {}
-        for tab in tabs_dict:
-            dump_dict[tab] = []
-            for item in tabs_dict[tab]:
-                item_type = type(item)
-                if item_type == custom_nodes.NEPComment:
-                    dump_dict[tab].append(
-                        {"nep_type": "comment", "label": item.label, "pos": {"x": item.pos().x(), "y": item.pos().y()},
-                         "width": item.content_rect.width(), "height": item.content_rect.height(),
-                         "bg_color": item.bg_color.name(), "is_pinned": item.is_pinned})
-                elif item_type == custom_nodes.NEPImage:
-                    dump_dict[tab].append({"nep_type": "image", "img_index": item.img_index,
-                                           "pos": {"x": item.pos().x(), "y": item.pos().y()},
-                                           "width": item.content_rect.width(), "height": item.content_rect.height(),
-                                           "bg_color": item.bg_color.name(), "is_pinned": item.is_pinned})
-
-        self.create_nep_data(create_string_attr="NEP_DATA")
-        cmds.setAttr(NODE_EDITOR_CFG + ".NEP_DATA", json.dumps(dump_dict), type="string")
+            page = stack.itemAt(i).widget()
+            if page in self._pending_tabs:
+                # never activated, save back what was loaded untouched
+                pending_tabs[page] = self._pending_tabs[page]
+                dump_dict[tabbar.tabText(i)] = pending_tabs[page]
+                continue
+            graph_view = page.findChild(QGraphicsView)
+            if not graph_view:
+                continue
+            scene = graph_view.scene()
+            if scene in dirty_scenes or scene not in cached_tabs:
+                tabs[scene] = self.serialize_scene_items(scene)
+            else:
+                tabs[scene] = cached_tabs[scene]
+            dump_dict[tabbar.tabText(i)] = tabs[scene]
+        return dump_dict, tabs, pending_tabs
+
+    def snapshot_journal_document(self):
+        # document for the autosave journal, None if nothing changed since its last entry
+        if not self._journal_dirty_scenes:
+            return None
+        dump_dict, self._journal_tabs, pending_tabs = self.snapshot_document(self._journal_dirty_scenes,
+                                                                             self._journal_tabs)
+        self._journal_dirty_scenes = set()
+        return dump_dict
+
+    @profiler.timed_operation("save")
+    def save_nep_data_to_scene(self):
+        ''' Only tabs marked dirty by their items get serialized again, the others reuse what was
+        saved last time. The attribute isn't touched at all if nothing changed.
+        '''
+        dump_dict, saved_tabs, pending_tabs = self.snapshot_document(self._dirty_scenes, self._saved_tabs)
+
+        self._saved_tabs = saved_tabs  # also drops tabs that were closed
+        self._pending_tabs = pending_tabs
+        self._dirty_scenes = set()
+        if dump_dict != self._saved_document:
+            self.create_nep_data(create_string_attr="NEP_DATA")
+            cmds.setAttr(NODE_EDITOR_CFG + ".NEP_DATA", nep_codec.encode_document(dump_dict), type="string")
+            self._saved_document = dump_dict
+
+        # convert images of older scenes to the current storage
+        self.img_store.migrate()
+
+    def recover_journal(self):
+        # offers the autosave journal left by a crash, loaded by load_nep_data_from_scene
+        # its images already point at the slots of the scene as it was opened, see NEPJournal.resolve_images
+        self._recovered_document = self.journal.offer_recovery()
 
+    @profiler.timed_operation("load")
     def load_nep_data_from_scene(self):
+        ''' Tabs are hydrated lazily, only the current one gets its items now and the others keep
+        their saved records until they are activated (see tab_change_callback).
+        '''
         load_dict = {}
 
-        if cmds.objExists(NODE_EDITOR_CFG):
-            if cmds.attributeQuery("NEP_DATA", node=NODE_EDITOR_CFG, exists=True):
-                load_dict = json.loads(cmds.getAttr(NODE_EDITOR_CFG + ".NEP_DATA"))
-            else:
-                return
-
-        ctrl = OpenMayaUI.MQtUtil.findControl(self.node_editor)
-        if ctrl is None:
-            raise RuntimeError("Node editor is not open")
-        nodeEdPane = wrapInstance(int(ctrl), QWidget)
+        if self._recovered_document is not None:
+            load_dict = self._recovered_document
+            self._recovered_document = None
+        elif cmds.objExists(NODE_EDITOR_CFG) and cmds.attributeQuery("NEP_DATA", node=NODE_EDITOR_CFG, exists=True):
+            load_dict = nep_codec.decode_document(cmds.getAttr(NODE_EDITOR_CFG + ".NEP_DATA"))
 
-        tabbar = nodeEdPane.findChild(QTabBar)
-        stack = nodeEdPane.findChild(QStackedLayout)
+        tabbar, stack = self.get_tabs_widgets()
         for i in range(tabbar.count() - 1):  # removes +
             tab_name = tabbar.tabText(i)
             if tab_name in load_dict:
-                stack.setCurrentIndex(i)
-                graph_view = stack.currentWidget().findChild(QGraphicsView)
-                scene = graph_view.scene()
-
-                for item in load_dict[tab_name]:
-                    if item["nep_type"] == "comment":
-                        nep_item = custom_nodes.NEPComment(label=item["label"],
-                                                           content_rect=QRectF(0, 0, item["width"] - 20,
-                                                                               item["height"] - 20), NEP=self,
-                                                           bg_color=item["bg_color"], is_pinned=item["is_pinned"])
-                    elif item["nep_type"] == "image":
-                        if not cmds.objExists(NODE_EDITOR_CFG) or not cmds.attributeQuery("IMG_LIST",
-                                                                                          node=NODE_EDITOR_CFG,
-                                                                                          exists=True):
-                            encoded_image = self.get_not_found_encoded_img()
-                        else:
-                            encoded_image = cmds.getAttr(NODE_EDITOR_CFG + ".IMG_LIST")[item["img_index"]]
-                        nep_item = custom_nodes.NEPImage(label="", encoded_image=encoded_image,
-                                                         content_rect=QRectF(0, 0, item["width"] - 20,
-                                                                             item["height"] - 20), NEP=self,
-                                                         bg_color=item["bg_color"], is_pinned=item["is_pinned"])
-                        nep_item.set_img_index(item["img_index"])
-                    scene.addItem(nep_item)
-
-                    if item["nep_type"] == "comment":
-                        nep_item.setZValue(-1)
-                    nep_item.setPos(item["pos"]["x"], item["pos"]["y"])
+                self._pending_tabs[stack.itemAt(i).widget()] = load_dict[tab_name]
+
+        self.hydrate_current_tab()
+
+    def hydrate_current_tab(self):
+        # creates the items of the current tab if they were not loaded yet
+        tabbar, stack = self.get_tabs_widgets()
+        page = stack.currentWidget()
+        graph_view = page.findChild(QGraphicsView)
+        if not graph_view:
+            return  # stays pending until the tab has a view
+        self.image_loader.watch_view(graph_view)
+        # keeps comment members up to date while nodes are dragged or created in this tab
+        self._membership_filter.watch(graph_view.scene())
+        records = self._pending_tabs.pop(page, None)
+        if records is None:
+            return
+        self.hydrate_scene(graph_view.scene(), records)
+
+    @profiler.timed_operation("load")
+    def hydrate_scene(self, scene, records):
+        # only timed when something is loaded, tab switches to hydrated tabs would record ~0 ms
+        self.create_items_from_records(scene, records)
+
+        # freshly loaded tabs match what is saved
+        self._saved_tabs[scene] = records
+        self._journal_tabs[scene] = records
+        self._dirty_scenes.discard(scene)
+        self._journal_dirty_scenes.discard(scene)
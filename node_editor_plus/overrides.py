@@ -154,6 +154,8 @@ def decorate_bookmarks_functions(NEP):
             n1 = set(cmds.ls(type='nodeGraphEditorBookmarkInfo'))
             newInfos = n1 - n0
             if len(newInfos):
+                for newInfo in newInfos:
+                    NEP.bookmarks.add(newInfo)
                 newInfo = newInfos.pop()
                 NEP.save_nep_data_to_bookmark(newInfo)
             return output
@@ -194,14 +196,15 @@ def decorate_bookmarks_functions(NEP):
             if txt and len(txt):
                 txt = txt[0]
                 info = args[0]._findInfo(txt)
-                bookmark_name = cmds.getAttr(info + ".name")
-                NEP.save_nep_data_to_bookmark(bookmark_name=bookmark_name)
+                NEP.bookmarks.invalidate([info])
+                NEP.save_nep_data_to_bookmark(info_node=info)
             return output
         return wrapper
 
     def handle_rename_decor(function):
         def wrapper(*args, **kwargs):
             output = function(*args, **kwargs) # run original function
+            NEP.bookmarks.rename(args[0], args[1])
             # update hud text with new bookmark name
             NEP.set_bookmark_HUD_message("Loaded Bookmark: [{}:{}]".format(args[1], args[0]))
             return output
@@ -221,6 +224,8 @@ def decorate_bookmarks_functions(NEP):
                         if depNodeMessageAttr:
                             cmds.disconnectAttr(depNodeMessageAttr, nodeInfoDepNodeAttr)
 
+        NEP.bookmarks.remove(infos)
+
         # delete the supplied bookmarks
         todelete = []
         todelete.extend(infos)
@@ -0,0 +1,179 @@
+import math, time
+from collections import OrderedDict
+from PySide2.QtCore import Qt
+
+MIPMAP_BUDGET = 64 * 1024 * 1024  # bytes of scaled levels kept for all images together
+
+
+def pixmap_byte_size(pixmap):
+    return pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
+
+
+def get_mipmap_level(source_width, screen_width):
+    ''' Level of the pyramid to draw an image source_width pixels wide at screen_width pixels.
+    Level n is the source halved n times, the chosen level is never smaller than what is drawn.
+    '''
+    if screen_width <= 0 or screen_width >= source_width:
+        return 0
+    return int(math.floor(math.log2(source_width / screen_width)))
+
+
+class NEPMipmapCache():
+    ''' Pre-scaled versions of the pixmaps NEPImage draws, so zooming out or shrinking an image
+    doesn't rescale the full resolution pixmap on every repaint. Levels are built lazily from the
+    previous one and shared by every image using the same QPixmap (keyed by its cacheKey).
+    All levels of all images live in one LRU under MIPMAP_BUDGET; level 0 is the source itself
+    and is never stored here.
+    '''
+    budget = MIPMAP_BUDGET
+    _levels = None   # {(pixmap cache key, level): QPixmap}, least recently used first
+    bytes_used = 0
+
+    def __init__(self, budget=None):
+        self._levels = OrderedDict()
+        if budget is not None:
+            self.budget = budget
+
+    def get(self, pixmap, level):
+        # pixmap scaled down level times, built and cached on demand
+        if level <= 0 or pixmap.isNull():
+            return pixmap
+        key = (pixmap.cacheKey(), level)
+        scaled = self._levels.get(key)
+        if scaled is not None:
+            self._levels.move_to_end(key)
+            return scaled
+
+        previous = self.get(pixmap, level - 1)
+        if previous.width() <= 1 or previous.height() <= 1:
+            return previous  # can't go any smaller
+        scaled = previous.scaled(max(previous.width() // 2, 1), max(previous.height() // 2, 1),
+                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self._levels[key] = scaled
+        self.bytes_used += pixmap_byte_size(scaled)
+        self.evict()
+        return scaled
+
+    def get_for_size(self, pixmap, screen_width):
+        return self.get(pixmap, get_mipmap_level(pixmap.width(), screen_width))
+
+    def evict(self):
+        # drops least recently drawn levels until we are back under budget
+        while self.bytes_used > self.budget and len(self._levels) > 1:
+            key, scaled = self._levels.popitem(last=False)
+            self.bytes_used -= pixmap_byte_size(scaled)
+
+    def drop(self, pixmap):
+        # forgets every level of pixmap, call when it is not going to be drawn anymore
+        cache_key = pixmap.cacheKey()
+        for key in [key for key in self._levels if key[0] == cache_key]:
+            self.bytes_used -= pixmap_byte_size(self._levels.pop(key))
+
+    def clear(self):
+        self._levels.clear()
+        self.bytes_used = 0
+
+
+# shared by every NEPImage
+mipmaps = NEPMipmapCache()
+
+
+class NEPPixmapPool():
+    ''' Process wide flyweight of decoded pixmaps keyed by the content hash of the image, so the
+    same PNG used in several tabs, bookmarks or scenes is decoded and kept in memory only once.
+    Every NEPImage showing a pooled pixmap holds one reference, the pixmap is dropped when the
+    last one is released.
+    '''
+    _entries = None  # {content hash: [QPixmap, references]}
+    bytes_used = 0
+    hits = 0
+    misses = 0
+
+    def __init__(self):
+        self._entries = {}
+
+    def acquire(self, key):
+        # shared pixmap of key with one more reference, None if it isn't decoded
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry[1] += 1
+        return entry[0]
+
+    def insert(self, key, pixmap):
+        # adds a freshly decoded pixmap with one reference, returns the pixmap to use
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[1] += 1  # decoded twice, keep the first one
+            return entry[0]
+        self._entries[key] = [pixmap, 1]
+        self.bytes_used += pixmap_byte_size(pixmap)
+        return pixmap
+
+    def release(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._entries[key]
+            self.bytes_used -= pixmap_byte_size(entry[0])
+            mipmaps.drop(entry[0])
+
+    def get_stats(self):
+        return {"pixmaps": len(self._entries), "references": sum(e[1] for e in self._entries.values()),
+                "bytes": self.bytes_used, "hits": self.hits, "misses": self.misses}
+
+
+# shared by every NEPImage
+pool = NEPPixmapPool()
+
+
+class NEPPixmapResidency():
+    ''' Keeps track of the NEPImages holding a pooled pixmap, least recently painted first.
+    Once the pool goes over budget, images that haven't been painted for evict_after seconds
+    (off screen or in a background tab) release theirs and decode again when they are shown.
+    Budget is set from the nepPixmapBudgetMB optionVar by NodeEditorPlus.
+    '''
+    budget = 256 * 1024 * 1024
+    evict_after = 5.0  # seconds
+    _items = None      # {item: last painted}
+
+    def __init__(self):
+        self._items = OrderedDict()
+
+    def add(self, item):
+        self._items.pop(item, None)
+        self._items[item] = time.monotonic()
+        self.evict()
+
+    def touch(self, item):
+        # called on paint
+        if item in self._items:
+            self._items[item] = time.monotonic()
+            self._items.move_to_end(item)
+
+    def remove(self, item):
+        self._items.pop(item, None)
+
+    def evict(self):
+        # shared pixmaps only free memory once all their images are released
+        now = time.monotonic()
+        while pool.bytes_used > self.budget and self._items:
+            item, last_painted = next(iter(self._items.items()))
+            if now - last_painted < self.evict_after:
+                break  # everything left was on screen a moment ago
+            self.remove(item)
+            try:
+                item.release_pixmap()
+            except RuntimeError:
+                pass  # item was deleted by Maya
+
+    def clear(self):
+        self._items.clear()
+
+
+# shared by every NEPImage
+residency = NEPPixmapResidency()
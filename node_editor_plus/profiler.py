@@ -0,0 +1,227 @@
+import time
+from functools import wraps
+from collections import OrderedDict
+from PySide2.QtWidgets import QWidget
+from PySide2.QtGui import QPainter, QColor, QFont
+from PySide2.QtCore import Qt, QObject, QEvent, QTimer, QRect
+
+PAINT_TYPES = ["NEPComment", "NEPImage", "native"]
+WINDOW = 1.0  # seconds averaged by the HUD
+
+
+class NEPProfiler():
+    ''' Collects where the node editor spends its time, shown by NEPProfilerHUD.
+    Paint time of our items is measured by the timed_paint decorator; native items (Maya nodes,
+    connections and the background) are what is left of the whole viewport paint, which starts
+    when the viewport receives its Paint event and ends when the HUD on top of it is painted.
+    Drag events and load/save/align operations are timed by the code running them, geometry
+    changes count the members moved along with dragged comments.
+    Paint and drag timing only run while the HUD is shown, operations are always recorded.
+    '''
+    enabled = False
+
+    def __init__(self):
+        self.operations = OrderedDict()  # {name: seconds of the last run}
+        self.stats = {}                  # averages of the last finished WINDOW, see publish
+        self.reset_window()
+        self._frame_start = None
+        self._frame_nep = 0.0
+
+    def reset_window(self):
+        self._window_start = time.perf_counter()
+        self._frames = 0
+        self._frame_time = 0.0
+        self._paint = {paint_type: [0.0, 0] for paint_type in PAINT_TYPES}  # [seconds, items]
+        self._drag_events = 0
+        self._drag_time = 0.0
+        self._geometry_changes = 0
+
+    def begin_frame(self):
+        self._frame_start = time.perf_counter()
+        self._frame_nep = 0.0
+
+    def end_frame(self):
+        if self._frame_start is None:
+            return
+        frame_time = time.perf_counter() - self._frame_start
+        self._frame_start = None
+        self._frames += 1
+        self._frame_time += frame_time
+        self._paint["native"][0] += max(frame_time - self._frame_nep, 0.0)
+        self._paint["native"][1] += 1
+
+    def record_paint(self, paint_type, seconds):
+        self._paint[paint_type][0] += seconds
+        self._paint[paint_type][1] += 1
+        self._frame_nep += seconds
+
+    def record_drag(self, seconds):
+        self._drag_events += 1
+        self._drag_time += seconds
+
+    def record_geometry_changes(self, count):
+        self._geometry_changes += count
+
+    def record_operation(self, name, seconds):
+        self.operations[name] = seconds
+
+    def publish(self):
+        # turns the current window into self.stats once it is WINDOW seconds long
+        elapsed = time.perf_counter() - self._window_start
+        if elapsed < WINDOW:
+            return False
+        frames = max(self._frames, 1)
+        self.stats = {"fps": self._frames / elapsed,
+                      "frame_ms": self._frame_time / frames * 1000.0,
+                      "paint_ms": {t: self._paint[t][0] / frames * 1000.0 for t in PAINT_TYPES},
+                      "paint_items": {t: self._paint[t][1] / frames for t in PAINT_TYPES},
+                      "drag_rate": self._drag_events / elapsed,
+                      "drag_ms": self._drag_time / max(self._drag_events, 1) * 1000.0,
+                      "geometry_rate": self._geometry_changes / elapsed}
+        self.reset_window()
+        return True
+
+    def timed_paint(self, paint_type):
+        # decorator for the paint method of our items
+        def decorator(paint):
+            @wraps(paint)
+            def wrapper(item, *args):
+                if not self.enabled:
+                    return paint(item, *args)
+                start = time.perf_counter()
+                result = paint(item, *args)
+                self.record_paint(paint_type, time.perf_counter() - start)
+                return result
+            return wrapper
+        return decorator
+
+    def timed_operation(self, name):
+        # decorator for load, save and align entry points
+        def decorator(operation):
+            @wraps(operation)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return operation(*args, **kwargs)
+                finally:
+                    self.record_operation(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+
+# shared by every item and the HUD
+session = NEPProfiler()
+
+
+def timed_paint(paint_type):
+    return session.timed_paint(paint_type)
+
+
+def timed_operation(name):
+    return session.timed_operation(name)
+
+
+def is_enabled():
+    return session.enabled
+
+
+def record_drag(seconds):
+    session.record_drag(seconds)
+
+
+def record_geometry_changes(count):
+    if session.enabled:
+        session.record_geometry_changes(count)
+
+
+class NEPViewportPaintFilter(QObject):
+    # a frame starts when the viewport gets its Paint event
+    def eventFilter(self, widget, event):
+        if event.type() == QEvent.Paint:
+            session.begin_frame()
+        return False
+
+
+class NEPProfilerHUD(QWidget):
+    ''' Transparent overlay covering the viewport of a QGraphicsView. It covers the whole
+    viewport so it gets painted right after every viewport paint, which closes the frame, but
+    only draws its text box in the top left corner and lets every mouse event through.
+    '''
+    margin = 8
+    box_size = QRect(0, 0, 270, 165)
+
+    def __init__(self, view):
+        super().__init__(view.viewport())
+        self.view = view
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.setAttribute(Qt.WA_NoSystemBackground)
+        self.setAttribute(Qt.WA_TranslucentBackground)
+        self.font = QFont("Consolas")
+        self.font.setStyleHint(QFont.Monospace)
+        self.font.setPointSize(8)
+        self._paint_filter = NEPViewportPaintFilter()
+        self._timer = QTimer(self)
+        self._timer.setInterval(int(WINDOW * 500))
+        self._timer.timeout.connect(self.refresh)
+
+    def start(self):
+        self.view.viewport().installEventFilter(self._paint_filter)
+        self.view.viewport().installEventFilter(self)  # follows resizes
+        self.setGeometry(self.view.viewport().rect())
+        session.enabled = True
+        session.reset_window()
+        self.show()
+        self.raise_()
+        self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+        session.enabled = False
+        try:
+            self.view.viewport().removeEventFilter(self._paint_filter)
+            self.view.viewport().removeEventFilter(self)
+        except RuntimeError:
+            pass  # view is gone already
+        self.hide()
+        self.deleteLater()
+
+    def eventFilter(self, widget, event):
+        if event.type() == QEvent.Resize:
+            self.setGeometry(widget.rect())
+        return False
+
+    def refresh(self):
+        if session.publish():
+            self.update(self.box_size.translated(self.margin, self.margin))
+
+    def get_lines(self):
+        stats = session.stats
+        if not stats:
+            return ["collecting..."]
+        lines = ["{:5.1f} fps  {:6.2f} ms/frame".format(stats["fps"], stats["frame_ms"])]
+        for paint_type in PAINT_TYPES:
+            line = "{:<11}{:6.2f} ms".format(paint_type, stats["paint_ms"][paint_type])
+            if paint_type != "native":  # native is the rest of the frame, not counted per item
+                line += "  {:6.0f} items".format(stats["paint_items"][paint_type])
+            lines.append(line)
+        lines.append("drag       {:5.0f} ev/s {:6.2f} ms".format(stats["drag_rate"], stats["drag_ms"]))
+        lines.append("members    {:5.0f} moves/s".format(stats["geometry_rate"]))
+        for name, seconds in session.operations.items():
+            lines.append("last {:<6}{:8.1f} ms".format(name, seconds * 1000.0))
+        return lines
+
+    def paintEvent(self, event):
+        session.end_frame()
+        box = self.box_size.translated(self.margin, self.margin)
+        if not event.rect().intersects(box):
+            return
+        painter = QPainter(self)
+        painter.fillRect(box, QColor(0, 0, 0, 160))
+        painter.setPen(QColor(220, 220, 220))
+        painter.setFont(self.font)
+        line_height = painter.fontMetrics().height()
+        y = box.top() + 6 + painter.fontMetrics().ascent()
+        for line in self.get_lines():
+            painter.drawText(box.left() + 6, y, line)
+            y += line_height
+        painter.end()
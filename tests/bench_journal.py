@@ -0,0 +1,99 @@
+''' Cost of one autosave journal tick on a 5,000 item graph: NEPJournal.tick on Maya's main
+thread (dirty tab snapshot through NodeEditorPlus.snapshot_journal_document and the hand off
+to the worker) and the encoding and atomic write done on the worker.
+    mayapy tests/bench_journal.py [items] [ticks]
+Needs Maya's python, the scene is renamed into a temporary folder so it gets journaled and
+the journal is written there instead of Maya's prefs.
+'''
+import os, sys, time, random, tempfile
+from harness import get_qapp, build_scene, random_records
+
+FRAME_BUDGET_MS = 16.0
+TABS = 4  # the 5,000 items are in the first tab, the others stay clean and reuse their records
+
+
+def make_bench_NEP(items):
+    # NodeEditorPlus without Maya's node editor, its tabs are plain Qt widgets
+    from PySide2.QtWidgets import QTabBar, QStackedLayout, QWidget, QGraphicsView, QVBoxLayout
+    from node_editor_plus import custom_nodes
+    from node_editor_plus.node_editor_plus import NodeEditorPlus
+
+    class BenchImageStore():
+        def get_slot_hash(self, slot):
+            return "{:040x}".format(slot)
+
+    class BenchNEP(NodeEditorPlus):
+        def __init__(self):
+            self._drag_manager = custom_nodes.NEPDragManager()
+            self.img_store = BenchImageStore()
+            self.image_loader = self
+            self.reset_saved_state()
+            self.tabbar = QTabBar()
+            self.stack = QStackedLayout()
+            self.pages = []
+            self.scenes = []
+            for tab in range(TABS):
+                scene = build_scene(random_records(items if tab == 0 else 50, seed=tab), NEP=self)
+                page = QWidget()
+                QVBoxLayout(page).addWidget(QGraphicsView(scene))
+                self.stack.addWidget(page)
+                self.tabbar.addTab("Tab {}".format(tab))
+                self.pages.append(page)
+                self.scenes.append(scene)
+            self.tabbar.addTab("+")
+
+        def get_tabs_widgets(self):
+            return self.tabbar, self.stack
+
+        def request_item(self, item):
+            pass  # images stay placeholders
+
+        def cancel(self, item):
+            pass
+
+    return BenchNEP()
+
+
+def main(items=5000, ticks=20):
+    import maya.standalone
+    maya.standalone.initialize()
+    get_qapp()
+    from maya import cmds
+    from node_editor_plus import journal
+
+    folder = tempfile.mkdtemp()
+    cmds.file(rename=os.path.join(folder, "bench.ma"))
+    NEP = make_bench_NEP(items)
+    writer = journal.NEPJournal(NEP, journal_dir=folder)
+    nep_items = NEP.scenes[0].items()
+    rng = random.Random(0)
+
+    def tick():
+        start = time.perf_counter()
+        writer.tick()
+        tick_ms = (time.perf_counter() - start) * 1000.0
+        writer._worker.join()
+        return tick_ms, (time.perf_counter() - start) * 1000.0 - tick_ms
+
+    for scene in NEP.scenes:
+        NEP.mark_dirty(scene)
+    first_ms, first_write_ms = tick()  # every record built once, like the first tick after a load
+    tick_ms = []
+    write_ms = []
+    for _ in range(ticks):
+        for item in rng.sample(nep_items, len(nep_items) // 100):  # the user moved 1% of the items
+            item.moveBy(10, 0)  # marks the tab dirty through itemChange
+        elapsed, written = tick()
+        tick_ms.append(elapsed)
+        write_ms.append(written)
+    assert writer.read() is not None, "journal was not written"
+
+    print("{} items, {} ticks".format(items, ticks))
+    print("first tick                {:7.2f} ms".format(first_ms))
+    print("tick (main thread)        {:7.2f} ms avg  {:7.2f} ms max".format(sum(tick_ms) / ticks, max(tick_ms)))
+    print("encode + write (worker)   {:7.2f} ms avg".format(sum(write_ms) / ticks))
+    assert max(tick_ms) < FRAME_BUDGET_MS, "journal tick would drop frames"
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
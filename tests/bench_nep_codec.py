@@ -0,0 +1,28 @@
+''' Size and speed of nep_codec against the version 1 json it replaced.
+    python tests/bench_nep_codec.py [tabs] [items per tab]
+'''
+import sys, json, timeit
+from harness import random_document
+from node_editor_plus import nep_codec
+
+
+def best_of(function, repeat=5):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def main(tabs=10, items_per_tab=1000):
+    document = random_document(tabs, items_per_tab)
+    v1 = json.dumps(document)
+    v2 = nep_codec.encode_document(document)
+    assert nep_codec.decode_document(v2) == document
+
+    print("{} tabs x {} items".format(tabs, items_per_tab))
+    print("size    v1 {:8.0f} KB   v2 {:8.0f} KB   {:.0%}".format(len(v1) / 1024, len(v2) / 1024, len(v2) / len(v1)))
+    print("encode  v1 {:8.1f} ms   v2 {:8.1f} ms".format(best_of(lambda: json.dumps(document)) * 1000,
+                                                           best_of(lambda: nep_codec.encode_document(document)) * 1000))
+    print("decode  v1 {:8.1f} ms   v2 {:8.1f} ms".format(best_of(lambda: json.loads(v1)) * 1000,
+                                                           best_of(lambda: nep_codec.decode_document(v2)) * 1000))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,39 @@
+''' Paint time of comments and images rendered offscreen, with the paint resources cached
+per item (what NEPComment does) against rebuilding them on every paint like before.
+    python tests/bench_paint.py [items] [frames]
+Needs PySide2, QT_QPA_PLATFORM defaults to offscreen.
+'''
+import sys, time
+from harness import get_qapp, build_scene, random_records
+
+
+def render_frames(scene, frames, uncached):
+    from PySide2.QtGui import QImage, QPainter
+    from PySide2.QtCore import QRectF
+    target = QImage(1920, 1080, QImage.Format_ARGB32_Premultiplied)
+    items = scene.items()
+    start = time.perf_counter()
+    for frame in range(frames):
+        if uncached:
+            for item in items:
+                item.invalidate_paint_cache()  # path, pens and brush built again in paint
+        painter = QPainter(target)
+        scene.render(painter, QRectF(target.rect()), QRectF(target.rect()))  # 100% zoom, full detail
+        painter.end()
+    return (time.perf_counter() - start) / frames * 1000.0
+
+
+def main(items=2000, frames=30):
+    get_qapp()
+    records = random_records(items)
+    for record in records:  # all on screen at 100%
+        record["pos"] = {"x": record["pos"]["x"] % 1800, "y": record["pos"]["y"] % 1000}
+    scene = build_scene(records)
+    render_frames(scene, 2, uncached=False)  # warm up fonts and pin icons
+    print("{} items, {} frames of 1920x1080".format(items, frames))
+    print("rebuilt every paint {:7.2f} ms/frame".format(render_frames(scene, frames, uncached=True)))
+    print("cached per item     {:7.2f} ms/frame".format(render_frames(scene, frames, uncached=False)))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:3]])
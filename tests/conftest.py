@@ -0,0 +1,6 @@
+import os, sys
+
+# tests import the package straight from the repository, like Maya does from the scripts dir
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
@@ -0,0 +1,81 @@
+''' Shared setup for the tests and the bench_*.py scripts in this folder.
+Tests that need Qt skip themselves when PySide2 isn't installed, the ones touching Maya
+only run inside mayapy.
+'''
+import os, sys, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+COLORS = ["#ffffff", "#ff5555", "#55ff55", "#5555ff", "#ffcc00", "#00ccff"]
+
+
+def random_records(count, seed=0):
+    # records as NEPComment/NEPImage.to_record write them, a third of them images
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        record = {"nep_type": "image" if i % 3 == 2 else "comment"}
+        if record["nep_type"] == "comment":
+            record["label"] = "Comment {} {}".format(i, rng.choice(["rig", "deform", "ctrl", "ünïcode"]))
+        else:
+            record["img_index"] = rng.randrange(0, 50)
+        record["pos"] = {"x": rng.choice([float(rng.randrange(-5000, 5000)), rng.uniform(-5000, 5000)]),
+                         "y": float(rng.randrange(-5000, 5000))}
+        record["width"] = float(rng.randrange(40, 800))
+        record["height"] = float(rng.randrange(40, 800))
+        record["bg_color"] = rng.choice(COLORS)
+        record["is_pinned"] = rng.random() < 0.1
+        records.append(record)
+    return records
+
+
+def random_document(tabs, items_per_tab, seed=0):
+    return {"Tab {}".format(t): random_records(items_per_tab, seed + t) for t in range(tabs)}
+
+
+def get_qapp():
+    from PySide2.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+
+class NEPStub():
+    # the parts of NodeEditorPlus our items talk to
+    grid_snap = False
+
+    def __init__(self):
+        from node_editor_plus import custom_nodes
+        self._drag_manager = custom_nodes.NEPDragManager()
+        self.dirty_scenes = set()
+        self.image_loader = self
+
+    def mark_dirty(self, scene):
+        self.dirty_scenes.add(scene)
+
+    def request_item(self, item):
+        pass  # images stay placeholders
+
+    def cancel(self, item):
+        pass
+
+
+def build_scene(records, NEP=None):
+    # QGraphicsScene with a NEPComment or NEPImage per record, images get a plain pixmap
+    from PySide2.QtCore import QRectF
+    from PySide2.QtGui import QPixmap, QColor
+    from PySide2.QtWidgets import QGraphicsScene
+    from node_editor_plus import custom_nodes
+
+    NEP = NEP or NEPStub()
+    scene = QGraphicsScene()
+    pixmap = QPixmap(256, 256)
+    pixmap.fill(QColor("#336699"))
+    for record in records:
+        content_rect = QRectF(0, 0, record["width"], record["height"])
+        if record["nep_type"] == "comment":
+            item = custom_nodes.NEPComment(record["label"], content_rect, NEP, bg_color=record["bg_color"])
+        else:
+            item = custom_nodes.NEPImage("", content_rect, NEP, pixmap=pixmap)
+        scene.addItem(item)
+        item.setPos(record["pos"]["x"], record["pos"]["y"])
+    return scene
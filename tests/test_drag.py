@@ -0,0 +1,101 @@
+import gc, tracemalloc
+import pytest
+
+pytest.importorskip("PySide2")
+
+from harness import get_qapp, NEPStub
+from PySide2.QtCore import QRectF
+from PySide2.QtWidgets import QGraphicsScene
+from node_editor_plus import custom_nodes
+
+MEMBERS = 50
+
+
+@pytest.fixture
+def comment_scene():
+    # a comment holding MEMBERS images, the stand-ins for native nodes Qt can build
+    get_qapp()
+    NEP = NEPStub()
+    scene = QGraphicsScene()
+    comment = custom_nodes.NEPComment("rig", QRectF(0, 0, 1000, 1000), NEP)
+    scene.addItem(comment)
+    images = []
+    for i in range(MEMBERS):
+        image = custom_nodes.NEPImage("", QRectF(0, 0, 40, 40), NEP)
+        scene.addItem(image)
+        image.setPos((i % 10) * 90 + 20, (i // 10) * 90 + 20)
+        images.append(image)
+    custom_nodes.update_memberships(scene)
+    yield NEP._drag_manager, scene, comment, images
+    NEP._drag_manager.get_refresh_timer().stop()
+
+
+def drag(drag_manager, scene, comment, frames, moves_per_frame):
+    # mouse moves as Qt delivers them, the refresh timer firing once they were handled
+    drag_manager.start_drag(caller=comment, scene=scene)
+    for frame in range(frames):
+        for move in range(moves_per_frame):
+            comment.moveBy(2, 1)
+            drag_manager.mid_drag()
+        drag_manager.get_refresh_timer().stop()
+        drag_manager.refresh_drag()
+    drag_manager.stop_drag()
+
+
+def test_geometry_changes_once_per_frame(comment_scene):
+    drag_manager, scene, comment, images = comment_scene
+    assert comment.members == set(images)
+
+    drag(drag_manager, scene, comment, frames=10, moves_per_frame=8)
+
+    # one translation per member and frame, however many mouse moves arrived
+    assert drag_manager.geometry_changes == MEMBERS * 10
+    assert images[0].pos().x() == 20 + 2 * 80
+    assert images[0].pos().y() == 20 + 1 * 80
+
+
+def test_members_are_not_reparented(comment_scene):
+    drag_manager, scene, comment, images = comment_scene
+    drag_manager.start_drag(caller=comment, scene=scene)
+    comment.moveBy(5, 5)
+    assert comment.childItems() == []
+    drag_manager.stop_drag()
+    assert all(image.parentItem() is None for image in images)
+    assert images[0].pos().x() == 25
+
+
+def test_drag_trusts_members(comment_scene):
+    drag_manager, scene, comment, images = comment_scene
+    # added without an update, it only joins through update_memberships
+    stray = custom_nodes.NEPImage("", QRectF(0, 0, 40, 40), comment._NEP)
+    scene.addItem(stray)
+    stray.setPos(500, 500)
+    scene.removeItem(images[0])  # removed behind our back, like Maya deleting a node
+
+    drag(drag_manager, scene, comment, frames=1, moves_per_frame=1)
+
+    assert stray.pos().x() == 500
+    assert images[0] not in comment.members
+    assert images[0].pos().x() == 20
+    assert images[1].pos().x() == 20 + 90 + 2
+
+
+def test_memory_stays_flat_across_drag_cycles(comment_scene):
+    drag_manager, scene, comment, images = comment_scene
+    for cycle in range(200):  # warm up caches and the refresh timer
+        drag(drag_manager, scene, comment, frames=1, moves_per_frame=1)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for cycle in range(10000):
+        drag(drag_manager, scene, comment, frames=1, moves_per_frame=1)
+    gc.collect()
+    grown = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    # nothing kept per drag: no reparented children, no registry of released items
+    assert grown < 64 * 1024
+    assert comment.childItems() == []
+    assert drag_manager.items_being_dragged == []
+    assert comment.members == set(images)
@@ -0,0 +1,49 @@
+import json
+import pytest
+from harness import random_document, random_records
+from node_editor_plus import nep_codec
+
+
+def test_round_trip():
+    document = random_document(tabs=5, items_per_tab=300)
+    assert nep_codec.decode_document(nep_codec.encode_document(document)) == document
+
+
+def test_round_trip_keeps_tab_order_and_empty_tabs():
+    document = {"b": random_records(3), "empty": [], "a": random_records(2, seed=1)}
+    decoded = nep_codec.decode_document(nep_codec.encode_document(document))
+    assert list(decoded) == ["b", "empty", "a"]
+    assert decoded == document
+
+
+def test_reads_version_1():
+    # what every NEP version before the codec saved, json of the in memory layout
+    document = random_document(tabs=2, items_per_tab=50)
+    assert nep_codec.decode_document(json.dumps(document)) == document
+
+
+def test_version_1_bookmark_reencodes_the_same():
+    document = {"bookmark": random_records(20)}
+    decoded = nep_codec.decode_document(json.dumps(document))
+    assert nep_codec.decode_document(nep_codec.encode_document(decoded)) == document
+
+
+def test_palette_is_shared_between_tabs():
+    document = random_document(tabs=3, items_per_tab=100)
+    encoded = json.loads(nep_codec.encode_document(document))
+    assert len(encoded["palette"]) == len({r["bg_color"] for records in document.values() for r in records})
+
+
+def test_empty_data():
+    assert nep_codec.decode_document("") == {}
+    assert nep_codec.decode_document(None) == {}
+
+
+def test_newer_version_is_refused():
+    with pytest.raises(ValueError):
+        nep_codec.decode_document(json.dumps({"nep_version": nep_codec.VERSION + 1, "palette": [], "tabs": {}}))
+
+
+def test_smaller_than_version_1():
+    document = random_document(tabs=2, items_per_tab=500)
+    assert len(nep_codec.encode_document(document)) < len(json.dumps(document)) / 2